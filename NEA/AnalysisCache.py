@@ -0,0 +1,75 @@
+import sqlite3
+import time
+
+# Search results kept on disk between runs, keyed by the position's hash key (GameState.computeHashKey) so any
+# process can look up a position another one has already searched. It is a single SQLite file in WAL mode which lets
+# any number of processes read while one writes.
+#
+#   cache = AnalysisCache("analysis.sqlite")
+#   move = gs.getBestMove(3, cache)
+
+defaultPath = 'analysis_cache.sqlite'
+defaultMaxEntries = 1000000
+# a hit only records when the entry was last used if that was longer ago than this (seconds), so a position that is
+# looked up over and over doesn't turn every lookup into a write
+touchInterval = 60.0
+
+
+def toSigned(key):
+    # SQLite integers are signed 64 bit, the hash keys are unsigned
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class AnalysisCache():
+    def __init__(self, path=defaultPath, maxEntries=defaultMaxEntries):
+        self.maxEntries = maxEntries
+        # the size is only checked every so often as counting rows on every store would cost more than the lookups
+        self.storesSinceCheck = 0
+        self.checkEvery = max(1, maxEntries // 100)
+        # autocommit, each store is its own short transaction so writers don't hold the lock while searching
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS analysis ('
+                                'key INTEGER PRIMARY KEY, depth INTEGER, score REAL, move INTEGER, stored REAL, '
+                                'used REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS analysisUsed ON analysis (used)')
+
+    def lookup(self, key, depth):
+        # returns (depth, score, moveID) if the position has been searched at least depth deep, otherwise None
+        row = self.connection.execute('SELECT depth, score, move, used FROM analysis WHERE key = ?',
+                                      (toSigned(key),)).fetchone()
+        if row is None or row[0] < depth:
+            return None
+        now = time.time()
+        if now - row[3] > touchInterval:
+            self.connection.execute('UPDATE analysis SET used = ? WHERE key = ?', (now, toSigned(key)))
+        return row[:3]
+
+    def store(self, key, depth, score, moveID):
+        # a deeper result already stored for the position is kept
+        now = time.time()
+        self.connection.execute('INSERT INTO analysis VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+                                'depth = excluded.depth, score = excluded.score, move = excluded.move, '
+                                'stored = excluded.stored, used = excluded.used WHERE excluded.depth >= analysis.depth',
+                                (toSigned(key), depth, score, moveID, now, now))
+        self.storesSinceCheck += 1
+        if self.storesSinceCheck >= self.checkEvery:
+            self.storesSinceCheck = 0
+            self.evict()
+
+    def evict(self):
+        # once over the size limit the results used longest ago go first (popular positions like openings and
+        # puzzles stay however long ago they were searched), down to 90% of the limit so this doesn't run again
+        # straight away
+        count = self.connection.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+        if count > self.maxEntries:
+            self.connection.execute('DELETE FROM analysis WHERE key IN '
+                                    '(SELECT key FROM analysis ORDER BY used LIMIT ?)',
+                                    (count - self.maxEntries * 9 // 10,))
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
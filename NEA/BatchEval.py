@@ -0,0 +1,78 @@
+import ChessEngine
+import numpy as np
+
+# Evaluates many positions at once with NumPy, for scoring datasets offline. Positions are an (N, 64) int8 array of
+# the 4 bit piece codes from ChessEngine.pieceCodes, square r * 8 + c, and the scores match GameState.staticEval
+# (which is what boardEval returns for any position that isn't checkmate or stalemate).
+#
+#   codes = BatchEval.positionsToArray(states)    or    BatchEval.bytesToArray(ChessEngine.encodePositions(states))
+#   scores = BatchEval.evaluateBatch(codes)
+
+rows = np.arange(8)
+
+
+def buildSquareScores():
+    # material plus piece square score for every piece code on every square, an empty square scores 0
+    squareScores = np.zeros((16, 64), dtype=np.int32)
+    for piece, code in ChessEngine.pieceCodes.items():
+        if piece != '--':
+            pieceSquare = np.array(ChessEngine.pieceSquareTables[piece]).ravel()
+            squareScores[code] = ChessEngine.materialValues[piece] + pieceSquare
+    return squareScores
+
+
+squareScores = buildSquareScores()
+
+
+def positionsToArray(states):
+    codes = np.zeros((len(states), 64), dtype=np.int8)
+    for i, gs in enumerate(states):
+        codes[i] = [ChessEngine.pieceCodes[piece] for row in gs.board for piece in row]
+    return codes
+
+
+def bytesToArray(buffer):
+    # unpacks the squares from a buffer made by ChessEngine.encodePositions without building any GameStates
+    packed = np.frombuffer(buffer, dtype=np.uint8).reshape(-1, ChessEngine.positionSize)[:, :32]
+    codes = np.empty((packed.shape[0], 64), dtype=np.int8)
+    codes[:, 0::2] = packed >> 4
+    codes[:, 1::2] = packed & 15
+    return codes
+
+
+def adjacentFiles(perFile, fill, combine):
+    # combines each file's value with the files either side of it, off the board counts as fill
+    padded = np.pad(perFile, ((0, 0), (1, 1)), constant_values=fill)
+    return combine(combine(padded[:, :-2], padded[:, 1:-1]), padded[:, 2:])
+
+
+def pawnStructureBatch(codes):
+    # the same doubled, isolated and passed pawn terms as GameState.getPawnStructureScore
+    board = codes.reshape(-1, 8, 8)
+    wPawns = board == ChessEngine.pieceCodes['wP']
+    bPawns = board == ChessEngine.pieceCodes['bP']
+    wCount = wPawns.sum(axis=1)
+    bCount = bPawns.sum(axis=1)
+    score = ChessEngine.doubledPawnPenalty * (np.maximum(bCount - 1, 0).sum(axis=1) -
+                                              np.maximum(wCount - 1, 0).sum(axis=1))
+    # isolated, no friendly pawns on the files either side
+    wPadded = np.pad(wCount, ((0, 0), (1, 1)))
+    bPadded = np.pad(bCount, ((0, 0), (1, 1)))
+    wIsolated = (wPadded[:, :-2] == 0) & (wPadded[:, 2:] == 0)
+    bIsolated = (bPadded[:, :-2] == 0) & (bPadded[:, 2:] == 0)
+    score += ChessEngine.isolatedPawnPenalty * ((bCount * bIsolated).sum(axis=1) - (wCount * wIsolated).sum(axis=1))
+    # passed, a white pawn needs every black pawn on its own and the adjacent files to be level with it or behind it
+    # (row not less than its row), black is the other way round
+    bFront = adjacentFiles(np.where(bPawns, rows[:, None], 8).min(axis=1), 8, np.minimum)
+    wFront = adjacentFiles(np.where(wPawns, rows[:, None], -1).max(axis=1), -1, np.maximum)
+    wPassed = wPawns & (rows[:, None] <= bFront[:, None, :])
+    bPassed = bPawns & (rows[:, None] >= wFront[:, None, :])
+    bonus = np.array(ChessEngine.passedPawnBonus)
+    score += (wPassed * bonus[:, None]).sum(axis=(1, 2)) - (bPassed * bonus[::-1, None]).sum(axis=(1, 2))
+    return score
+
+
+def evaluateBatch(codes):
+    # one gather of every square's score then a sum across each position
+    codes = np.asarray(codes, dtype=np.intp)
+    return squareScores[codes, np.arange(64)].sum(axis=1) + pawnStructureBatch(codes)
@@ -0,0 +1,194 @@
+import ChessEngine
+import Puzzles
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Micro benchmarks of the engine's hot paths over a fixed set of positions. Each run is added to a JSON history file
+# and compared with the run before it, anything slower by more than the threshold is reported as a regression (and
+# the exit code is 1 so it can fail a CI job).
+#
+#   python Benchmark.py                   run everything, save it and compare with the last run
+#   python Benchmark.py --quick --no-save
+#
+# Before timing anything the incrementally updated state (hash key, checkers) is checked against a from scratch
+# recompute at every node a couple of plies deep from each position, a mismatch exits with 2.
+
+historyPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_history.json')
+defaultThreshold = 0.10
+
+middlegameMoves = ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4', 'g8f6', 'd2d3', 'f8c5', 'e1g1', 'd7d6', 'c2c3', 'e8g8',
+                   'c1g5', 'h7h6', 'g5h4', 'c8g4', 'b1d2', 'a7a6']
+endgameBoard = [
+    ["--", "--", "--", "--", "--", "--", "--", "--"],
+    ["--", "--", "--", "--", "--", "bP", "bK", "--"],
+    ["--", "--", "--", "--", "--", "--", "bP", "--"],
+    ["--", "bR", "--", "--", "--", "--", "--", "bP"],
+    ["--", "--", "--", "--", "--", "--", "--", "--"],
+    ["--", "--", "--", "--", "--", "wP", "--", "wP"],
+    ["wP", "--", "--", "--", "--", "--", "wP", "wK"],
+    ["--", "--", "--", "--", "wR", "--", "--", "--"]]
+# black keeps kingside castling until the bishop takes the rook on h8 and leaves again, the right has to go with
+# the rook
+rookCaptureFen = "4k2r/p7/8/8/8/8/PB6/4K3 w k - 0 1"
+rookCaptureMoves = ['b2h8', 'a7a6', 'h8c3']
+
+
+def corpus():
+    # the positions every benchmark is run over, by name
+    opening = ChessEngine.GameState()
+    middlegame = playMoves(ChessEngine.GameState(), middlegameMoves)
+    endgame = ChessEngine.GameState().setPosition(endgameBoard, True)
+    puzzle = Puzzles.positionFromFen(Puzzles.puzzleList[0][1])
+    return {'opening': opening, 'middlegame': middlegame, 'endgame': endgame, 'puzzle': puzzle}
+
+
+def playMoves(gs, notations):
+    for notation in notations:
+        gs.makeMove([m for m in gs.getValidMoves() if m.getChessNot() == notation][0])
+    return gs
+
+
+def checkPositions():
+    # the corpus and the other positions the consistency check walks from
+    positions = corpus()
+    positions['rook capture'] = playMoves(Puzzles.positionFromFen(rookCaptureFen), rookCaptureMoves)
+    return positions
+
+
+def checkConsistency(gs, depth):
+    # number of nodes, down to depth plies, where the incremental hash key or checkers don't match a recompute
+    gs.checkMate = False
+    gs.stalemate = False
+    bad = 0
+    if gs.hashKeyLog[-1] != gs.computeHashKey() or sorted(gs.checkersLog[-1]) != sorted(gs.getCheckers()):
+        bad += 1
+    if depth > 0:
+        for move in gs.getValidMoves():
+            gs.makeMove(move)
+            bad += checkConsistency(gs, depth - 1)
+            gs.undoMove()
+        gs.checkMate = False
+        gs.stalemate = False
+    return bad
+
+
+def timeIt(function, repeats, number):
+    # best of repeats runs, each timing number calls, in seconds per call
+    best = float('inf')
+    for i in range(repeats):
+        start = time.perf_counter()
+        for j in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def benchmarks(gs, quick):
+    # (name, function, calls per timing) for one position, every function leaves the position as it found it
+    def validMoves():
+        gs.getValidMoves()
+        gs.checkMate = False
+        gs.stalemate = False
+
+    def squaresAttacked():
+        for r in range(8):
+            for c in range(8):
+                gs.squareUnderAttack(r, c)
+
+    moves = gs.getValidMoves()
+
+    def makeUndo():
+        for move in moves:
+            gs.makeMove(move)
+            gs.undoMove()
+
+    tests = [('getValidMoves', validMoves, 20),
+             ('getAllMoves', gs.getAllMoves, 50),
+             ('squareUnderAttack x64', squaresAttacked, 20),
+             ('boardEval', gs.boardEval, 20),
+             ('makeMove/undoMove x%d' % len(moves), makeUndo, 20),
+             ('getBestMove depth 0', lambda: gs.getBestMove(0), 2),
+             ('getBestMove depth 1', lambda: gs.getBestMove(1), 1)]
+    if not quick:
+        tests.append(('getBestMove depth 2', lambda: gs.getBestMove(2), 1))
+    return tests
+
+
+def runBenchmarks(quick=False, log=print):
+    results = {}
+    repeats = 2 if quick else 5
+    for positionName, gs in corpus().items():
+        for testName, function, number in benchmarks(gs, quick):
+            name = positionName + ': ' + testName
+            results[name] = timeIt(function, repeats, number)
+            log("%-45s %12.1f us" % (name, results[name] * 1e6))
+    return results
+
+
+def loadHistory(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def currentCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(previous, results, threshold):
+    # returns (name, old, new, ratio) for every benchmark in both runs, and the names that got slower than threshold
+    rows = []
+    regressions = []
+    for name, seconds in results.items():
+        if name in previous:
+            ratio = seconds / previous[name]
+            rows.append((name, previous[name], seconds, ratio))
+            if ratio > 1 + threshold:
+                regressions.append(name)
+    return rows, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark move generation, evaluation and search")
+    parser.add_argument('--quick', action='store_true', help="fewer repeats and no depth 2 searches")
+    parser.add_argument('--history', default=historyPath)
+    parser.add_argument('--threshold', type=float, default=defaultThreshold,
+                        help="fraction slower than the last run that counts as a regression")
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    for positionName, gs in checkPositions().items():
+        mismatches = checkConsistency(gs, 3 if positionName == 'rook capture' else 2)
+        if mismatches:
+            print("%s: %d position(s) where the incremental state doesn't match a recompute"
+                  % (positionName, mismatches))
+            sys.exit(2)
+
+    history = loadHistory(args.history)
+    results = runBenchmarks(args.quick)
+    regressions = []
+    # only runs of the same kind are compared
+    previous = [run for run in history if run.get('quick', False) == args.quick]
+    if previous:
+        print("\nCompared with", previous[-1].get('commit') or previous[-1]['time'])
+        rows, regressions = compare(previous[-1]['results'], results, args.threshold)
+        for name, old, new, ratio in rows:
+            flag = "  REGRESSION" if name in regressions else ""
+            print("%-45s %10.1f -> %10.1f us  %+6.1f%%%s" % (name, old * 1e6, new * 1e6, (ratio - 1) * 100, flag))
+    if not args.no_save:
+        history.append({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': currentCommit(), 'quick': args.quick,
+                        'results': results})
+        with open(args.history, 'w') as f:
+            json.dump(history, f, indent=1)
+    if regressions:
+        print("\n%d regression(s) over %d%%" % (len(regressions), args.threshold * 100))
+        sys.exit(1)
@@ -1,5 +1,227 @@
 import math
 import copy
+import json
+import os
+import random
+import struct
+import time
+
+# Lookup tables built once at import so the move generators and attack checks never repeat the offset arithmetic
+# or the "is this still on the board" checks. Every table is indexed [row][col] and holds (row, col) squares.
+knightOffsets = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+kingOffsets = ((-1, -1), (1, -1), (1, 1), (-1, 1), (-1, 0), (0, -1), (1, 0), (0, 1))
+rookDirections = ((-1, 0), (0, -1), (1, 0), (0, 1))
+bishopDirections = ((-1, -1), (1, -1), (1, 1), (-1, 1))
+
+
+def buildTargets(offsets):
+    # every on board square one offset away from each square
+    return [[tuple((r + dr, c + dc) for dr, dc in offsets if 0 <= r + dr < 8 and 0 <= c + dc < 8)
+             for c in range(8)] for r in range(8)]
+
+
+def buildRays(directions):
+    # for each square one ray per direction, each ray ordered from the nearest square outwards so a slider can stop
+    # at the first piece it meets
+    rays = [[None] * 8 for r in range(8)]
+    for r in range(8):
+        for c in range(8):
+            squareRays = []
+            for dr, dc in directions:
+                ray = []
+                endRow, endCol = r + dr, c + dc
+                while 0 <= endRow < 8 and 0 <= endCol < 8:
+                    ray.append((endRow, endCol))
+                    endRow, endCol = endRow + dr, endCol + dc
+                if ray:
+                    squareRays.append(tuple(ray))
+            rays[r][c] = tuple(squareRays)
+    return rays
+
+
+def buildPawnTables(colour):
+    # pushes hold the single step followed by the double step when the pawn is still on its starting rank,
+    # captures hold the left then the right diagonal
+    forward = -1 if colour == 'w' else 1
+    startRow = 6 if colour == 'w' else 1
+    pushes = [[()] * 8 for r in range(8)]
+    captures = [[()] * 8 for r in range(8)]
+    for r in range(8):
+        if not 0 <= r + forward < 8:
+            continue
+        for c in range(8):
+            if r == startRow:
+                pushes[r][c] = ((r + forward, c), (r + 2 * forward, c))
+            else:
+                pushes[r][c] = ((r + forward, c),)
+            captures[r][c] = tuple((r + forward, endCol) for endCol in (c - 1, c + 1) if 0 <= endCol < 8)
+    return pushes, captures
+
+
+knightTargets = buildTargets(knightOffsets)
+kingTargets = buildTargets(kingOffsets)
+rookRays = buildRays(rookDirections)
+bishopRays = buildRays(bishopDirections)
+pawnPushes = {}
+pawnCaptures = {}
+for colour in ('w', 'b'):
+    pawnPushes[colour], pawnCaptures[colour] = buildPawnTables(colour)
+
+
+def buildLines():
+    # for each square, every square in line with it mapped to the ray from the first square through it and the
+    # sliders that move along that ray, used to find checks along a line from the king
+    lines = [[None] * 8 for r in range(8)]
+    for r in range(8):
+        for c in range(8):
+            squareLines = {}
+            for rays, pieceTypes in ((rookRays[r][c], 'RQ'), (bishopRays[r][c], 'BQ')):
+                for ray in rays:
+                    for square in ray:
+                        squareLines[square] = (ray, pieceTypes)
+            lines[r][c] = squareLines
+    return lines
+
+
+lines = buildLines()
+
+# material values used by the static exchange evaluation, boardEval starts with the same ones but they can be
+# replaced by tuned ones (see evalTablesPath)
+pieceValues = {'P': 100, 'N': 300, 'B': 300, 'R': 500, 'Q': 900, 'K': 20000}
+
+# Evaluation tables from white's point of view, the black tables are the same tables flipped with the signs swapped
+# Pawns
+wPpieceSquare = [[0, 0, 0, 0, 0, 0, 0, 0],
+                 [50, 50, 50, 50, 50, 50, 50, 50],
+                 [10, 10, 20, 25, 25, 20, 10, 10],
+                 [5, 5, 10, 100, 100 , 10, 5, 5],
+                 [3, 3, 10, 100, 100, 10, 3, 3],
+                 [5, -5, -10, 0, 60, -10, -5, 5],
+                 [5, 10, 10, 10, 10, 10, 10, 5],
+                 [0, 0, 0, 0, 0, 0, 0, 0]]
+
+# Knights
+wNpieceSquare = [[-50, -40, -30, -30, -30, -30, -40, -50],
+                 [-40, -20, 0, 0, 0, 0, -20, -40],
+                 [-30, 20, 0, 0, 0, 0, 20, -30],
+                 [-30, 5, 5, 5, 5, 5, 5, -30],
+                 [-30, 5, 5, 5, 5, 5, 5, -30],
+                 [-30, 20, 20, 10, 10, 20, 20, -30],
+                 [-40, -20, 0, 20, 20, 0, -20, -40],
+                 [-50, -40, -30, -30, -30, -30, -40, -50]]
+
+# Bishops
+wBpieceSquare = [[-20, -10, -10, -10, -10, -10, -10, -20],
+                 [-10, 0, 0, 0, 0, 0, 0, -10],
+                 [-10, 0, 5, 10, 10, 5, 0, -10],
+                 [-10, 5, 5, 10, 10, 5, 5, -10],
+                 [-10, 0, 10, 10, 10, 10, 0, -10],
+                 [-10, 10, 10, 10, 10, 10, 10, -10],
+                 [-10, 5, 0, 0, 0, 0, 5, -10],
+                 [-20, -10, -10, -10, -10, -10, -10, -20]]
+
+# Rooks
+wRpieceSquare = [[0, 0, 0, 0, 0, 0, 0, 0],
+                 [5, 10, 10, 10, 10, 10, 10, 5],
+                 [-5, 0, 0, 0, 0, 0, 0, -5],
+                 [-5, 0, 0, 0, 0, 0, 0, -5],
+                 [-5, 0, 0, 0, 0, 0, 0, -5],
+                 [-5, 0, 0, 0, 0, 0, 0, -5],
+                 [-5, 0, 0, 0, 0, 0, 0, -5],
+                 [0, 0, 0, 5, 5, 0, 0, 0]]
+
+# Queens
+wQpieceSquare = [[-20, -10, -10, -5, -5, -10, -10, -20],
+                 [-10, 0, 0, 0, 0, 0, 0, -10],
+                 [-10, 0, 5, 5, 5, 5, 0, -10],
+                 [-5, 0, 5, 5, 5, 5, 0, -5],
+                 [0, 0, 5, 5, 5, 5, 0, -5],
+                 [-10, 5, 5, 5, 5, 5, 0, -10],
+                 [-10, 0, 5, 0, 0, 0, 0, -10],
+                 [-20, -10, -10, -5, -5, -10, -10, -20]]
+
+# King
+wKpieceSquare = [[-30, -40, -40, -50, -50, -40, -40, -30],
+                 [-30, -40, -40, -50, -50, -40, -40, -30],
+                 [-30, -40, -40, -50, -50, -40, -40, -30],
+                 [-30, -40, -40, -50, -50, -40, -40, -30],
+                 [-20, -30, -30, -40, -40, -30, -30, -20],
+                 [-10, -20, -20, -20, -20, -20, -20, -10],
+                 [20, 20, 0, -10, -10, -10, 20, 40],
+                 [30, 50, 40, -10, 0, 20, 50, 30]]
+
+
+def reverseTable(table):
+    # black's scores are negative and black's back rank is row 0 so the table is flipped and negated
+    return [[-value for value in row] for row in reversed(table)]
+
+
+materialValues = {'wP': 100, 'wR': 500, 'wN': 300, 'wB': 300, 'wQ': 900, 'wK': 20000,
+                  'bP': -100, 'bR': -500, 'bN': -300, 'bB': -300, 'bQ': -900, 'bK': -20000}
+pieceSquareTables = {'wP': wPpieceSquare, 'wN': wNpieceSquare, 'wB': wBpieceSquare,
+                     'wR': wRpieceSquare, 'wQ': wQpieceSquare, 'wK': wKpieceSquare,
+                     'bP': reverseTable(wPpieceSquare), 'bN': reverseTable(wNpieceSquare),
+                     'bB': reverseTable(wBpieceSquare), 'bR': reverseTable(wRpieceSquare),
+                     'bQ': reverseTable(wQpieceSquare), 'bK': reverseTable(wKpieceSquare)}
+
+
+def setEvalTables(material, pieceSquare):
+    # material is the white value of each piece type ('P', 'N', ...) and pieceSquare the white table for each piece
+    # type, the tables are changed in place so everything holding on to them sees the new values
+    for pieceType in material:
+        materialValues['w' + pieceType] = material[pieceType]
+        materialValues['b' + pieceType] = -material[pieceType]
+    for pieceType in pieceSquare:
+        pieceSquareTables['w' + pieceType][:] = [list(row) for row in pieceSquare[pieceType]]
+        pieceSquareTables['b' + pieceType][:] = reverseTable(pieceSquare[pieceType])
+
+
+def loadEvalTables(path):
+    # tables written by Tuner.py, {"material": {"P": 100, ...}, "pieceSquare": {"P": [[...], ...], ...}}
+    with open(path) as f:
+        tables = json.load(f)
+    setEvalTables(tables.get('material', {}), tables.get('pieceSquare', {}))
+
+
+# tuned tables are loaded at startup if there are any next to this file
+evalTablesPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'evalTables.json')
+if os.path.exists(evalTablesPath):
+    loadEvalTables(evalTablesPath)
+
+# Pawn structure terms, passedPawnBonus is indexed by row from white's point of view (row 1 is about to promote)
+doubledPawnPenalty = 15
+isolatedPawnPenalty = 15
+passedPawnBonus = [0, 100, 60, 40, 25, 15, 10, 0]
+# number of slots in each GameState's pawn structure cache
+pawnHashSize = 4096
+
+# Checkmate scores are mateScore less the number of plies from the start of the search to the mate (negative when
+# black mates), so a quicker mate always scores higher. Any score within maxMatePly of mateScore is a mate.
+mateScore = 1000000
+maxMatePly = 1000
+
+# 4 bit codes for each piece used by GameState.toBytes, white pieces are 1-6 and black pieces are the same plus 8
+pieceCodes = {'--': 0, 'wP': 1, 'wN': 2, 'wB': 3, 'wR': 4, 'wQ': 5, 'wK': 6,
+              'bP': 9, 'bN': 10, 'bB': 11, 'bR': 12, 'bQ': 13, 'bK': 14}
+codePieces = ['--'] * 16
+for piece, code in pieceCodes.items():
+    codePieces[code] = piece
+# after the 32 bytes of squares come the flags, enpassant square, halfmove clock and 2 byte fullmove number
+positionTail = struct.Struct('>BBBH')
+positionSize = 32 + positionTail.size
+
+# Zobrist keys, one random 64 bit number per piece per square. The generator is seeded so every process builds the
+# same keys
+zobristRandom = random.Random(20230)
+zobristPieces = {}
+for colour in ('w', 'b'):
+    for pieceType in ('P', 'N', 'B', 'R', 'Q', 'K'):
+        zobristPieces[colour + pieceType] = [[zobristRandom.getrandbits(64) for c in range(8)] for r in range(8)]
+# the rest of the position, black to move, each castling right (wks, bks, wqs, bqs) and the file of an enpassant square
+zobristBlackToMove = zobristRandom.getrandbits(64)
+zobristCastling = [zobristRandom.getrandbits(64) for i in range(4)]
+zobristEnpassant = [zobristRandom.getrandbits(64) for c in range(8)]
+
 
 class GameState():
     def __init__(self):
@@ -36,11 +258,38 @@ class GameState():
         # Enpassant is also defined but is not set to a Bool as enpassant is not something that is as simple
         # as "true" or "false" but can occur multiple times per game give the perfect set of circumstances
         self.enpassantPossible = ()
+        self.enpassantPossibleLog = [self.enpassantPossible]
 
         self.currentCastlingRight = castleRights(True, True, True, True)
         self.castleRightsLog = [castleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
                                              self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
 
+        # a position loaded with fromBytes can start part way through a game, these are its move counters then
+        self.startPly = 0
+
+        # principal variations found by minimax, keyed by the number of moves made since the search started
+        self.searchRootPly = 0
+        self.pvTable = {}
+        # time (from time.time()) at which a timed search gives up, None when the search isn't timed
+        self.searchDeadline = None
+        # number of minimax and quiescence calls so far, for measuring search speed
+        self.nodes = 0
+        # score of the move the last getBestMove returned, from white's point of view (see describeScore)
+        self.searchScore = None
+
+        # pawn only hash key kept like the castle rights log, and the cache of pawn structure scores it indexes
+        self.pawnKeyLog = [self.computePawnKey()]
+        self.pawnHashTable = [None] * pawnHashSize
+
+        # squares of the pieces giving check to the side to move, worked out by makeMove and kept like the castle
+        # rights log so inCheck doesn't have to search for attackers
+        self.checkersLog = [self.getCheckers()]
+
+        # hash key of every position in the game and the number of moves since the last pawn move or capture,
+        # one entry per position like the logs above, for spotting repetitions and the fifty move rule
+        self.hashKeyLog = [self.computeHashKey()]
+        self.halfmoveClockLog = [0]
+
     # Function defined for making the move, self represents the instance of the class. By using the “self” keyword we
     # can access the attributes and methods of the class in python. It binds the attributes with the given arguments.
     def makeMove(self, move):
@@ -69,6 +318,7 @@ class GameState():
             self.enpassantPossible = ((move.startRow + move.endRow) // 2, move.startCol)
         else:
             self.enpassantPossible = ()
+        self.enpassantPossibleLog.append(self.enpassantPossible)
 
         if move.isCastleMove:
             if move.endCol - move.startCol == 2:
@@ -78,10 +328,108 @@ class GameState():
                 self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 2]
                 self.board[move.endRow][move.endCol - 2] = '--'
 
-        # Update castling rights - whenever king or rook move is played
+        # Update castling rights - whenever king or rook move is played. The rights are copied first so the entry in
+        # the log for the position before the move stays as it was
+        self.currentCastlingRight = castleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
+                                                 self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)
         self.updateCastleRights(move)
-        self.castleRightsLog.append(castleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                                 self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
+        self.castleRightsLog.append(self.currentCastlingRight)
+
+        # Update the pawn key whenever a pawn moves, promotes or is captured
+        pawnKey = self.pawnKeyLog[-1]
+        if move.pieceMoved[1] == 'P':
+            pawnKey ^= zobristPieces[move.pieceMoved][move.startRow][move.startCol]
+            if not move.isPawnPromotion:
+                pawnKey ^= zobristPieces[move.pieceMoved][move.endRow][move.endCol]
+        if move.pieceCaptured[1:] == 'P':
+            captureRow = move.startRow if move.isEnpassantMove else move.endRow
+            pawnKey ^= zobristPieces[move.pieceCaptured][captureRow][move.endCol]
+        self.pawnKeyLog.append(pawnKey)
+
+        # only the piece that moved, a slider behind a square that was emptied or the castled rook can give check
+        kingRow, kingCol = self.wKingLoc if self.whiteToMove else self.bKingLoc
+        colour = move.pieceMoved[0]
+        checkers = []
+        piece = self.board[move.endRow][move.endCol][1]
+        if piece == 'P':
+            if (kingRow, kingCol) in pawnCaptures[colour][move.endRow][move.endCol]:
+                checkers.append((move.endRow, move.endCol))
+        elif piece == 'N':
+            if (kingRow, kingCol) in knightTargets[move.endRow][move.endCol]:
+                checkers.append((move.endRow, move.endCol))
+        elif piece != 'K':
+            self.getSliderChecker(kingRow, kingCol, move.endRow, move.endCol, colour, checkers)
+        self.getSliderChecker(kingRow, kingCol, move.startRow, move.startCol, colour, checkers)
+        if move.isEnpassantMove:
+            self.getSliderChecker(kingRow, kingCol, move.startRow, move.endCol, colour, checkers)
+        elif move.isCastleMove:
+            rookCol = move.endCol - 1 if move.endCol - move.startCol == 2 else move.endCol + 1
+            self.getSliderChecker(kingRow, kingCol, move.endRow, rookCol, colour, checkers)
+        self.checkersLog.append(checkers)
+
+        # the hash key changes by the pieces that moved or were taken, the side to move, any castling rights that
+        # were lost (only a king or rook move, or taking a rook, loses them) and the enpassant square
+        key = self.hashKeyLog[-1] ^ zobristBlackToMove
+        key ^= zobristPieces[move.pieceMoved][move.startRow][move.startCol]
+        key ^= zobristPieces[self.board[move.endRow][move.endCol]][move.endRow][move.endCol]
+        if move.pieceCaptured != '--':
+            captureRow = move.startRow if move.isEnpassantMove else move.endRow
+            key ^= zobristPieces[move.pieceCaptured][captureRow][move.endCol]
+        if move.isCastleMove:
+            if move.endCol - move.startCol == 2:
+                rookStart, rookEnd = move.endCol + 1, move.endCol - 1
+            else:
+                rookStart, rookEnd = move.endCol - 2, move.endCol + 1
+            rook = self.board[move.endRow][rookEnd]
+            key ^= zobristPieces[rook][move.endRow][rookStart] ^ zobristPieces[rook][move.endRow][rookEnd]
+        if move.pieceMoved[1] == 'K' or move.pieceMoved[1] == 'R' or move.pieceCaptured[1:] == 'R':
+            before = self.castleRightsLog[-2]
+            after = self.currentCastlingRight
+            if before.wks != after.wks:
+                key ^= zobristCastling[0]
+            if before.bks != after.bks:
+                key ^= zobristCastling[1]
+            if before.wqs != after.wqs:
+                key ^= zobristCastling[2]
+            if before.bqs != after.bqs:
+                key ^= zobristCastling[3]
+        if self.enpassantPossibleLog[-2] != ():
+            key ^= zobristEnpassant[self.enpassantPossibleLog[-2][1]]
+        if self.enpassantPossible != ():
+            key ^= zobristEnpassant[self.enpassantPossible[1]]
+        self.hashKeyLog.append(key)
+        if move.pieceMoved[1] == 'P' or move.pieceCaptured != '--':
+            self.halfmoveClockLog.append(0)
+        else:
+            self.halfmoveClockLog.append(self.halfmoveClockLog[-1] + 1)
+
+    def getSliderChecker(self, kingRow, kingCol, r, c, colour, checkers):
+        # if the square is on a line from the king, adds the first piece along that line to checkers when it is a
+        # slider of the given colour that moves that way
+        line = lines[kingRow][kingCol].get((r, c))
+        if line is None:
+            return
+        ray, pieceTypes = line
+        for endRow, endCol in ray:
+            endPiece = self.board[endRow][endCol]
+            if endPiece != '--':
+                if endPiece[0] == colour and endPiece[1] in pieceTypes and (endRow, endCol) not in checkers:
+                    checkers.append((endRow, endCol))
+                return
+
+    def getCheckers(self):
+        # every opponent piece attacking the king of the side to move, searched for from scratch
+        allyColour = 'w' if self.whiteToMove else 'b'
+        oppColour = 'b' if self.whiteToMove else 'w'
+        r, c = self.wKingLoc if self.whiteToMove else self.bKingLoc
+        board = self.board
+        checkers = [(endRow, endCol) for endRow, endCol in knightTargets[r][c]
+                    if board[endRow][endCol] == oppColour + 'N']
+        checkers += [(endRow, endCol) for endRow, endCol in pawnCaptures[allyColour][r][c]
+                     if board[endRow][endCol] == oppColour + 'P']
+        for endRow, endCol in kingTargets[r][c]:
+            self.getSliderChecker(r, c, endRow, endCol, oppColour, checkers)
+        return checkers
 
     def undoMove(self):
         if len(self.moveLog) != 0:
@@ -102,10 +450,9 @@ class GameState():
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = '--'
                 self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow, move.endCol)
-            # undo a 2 square pawn advance
-            if move.pieceMoved[1] == 'P' and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
+            # the enpassant square goes back to whatever it was before the move
+            self.enpassantPossibleLog.pop()
+            self.enpassantPossible = self.enpassantPossibleLog[-1]
 
             # undoing castle move
             if move.isCastleMove:
@@ -119,6 +466,10 @@ class GameState():
             # undoing castling rights
             self.castleRightsLog.pop()
             self.currentCastlingRight = self.castleRightsLog[-1]
+            self.pawnKeyLog.pop()
+            self.checkersLog.pop()
+            self.hashKeyLog.pop()
+            self.halfmoveClockLog.pop()
 
     def updateCastleRights(self, move):
         if move.pieceMoved == 'wK':
@@ -140,11 +491,23 @@ class GameState():
                     self.currentCastlingRight.bqs = False
                 elif move.startCol == 7:
                     self.currentCastlingRight.bks = False
+        # a rook taken on its starting square can't castle any more either
+        if move.pieceCaptured == 'wR':
+            if move.endRow == 7:
+                if move.endCol == 0:
+                    self.currentCastlingRight.wqs = False
+                elif move.endCol == 7:
+                    self.currentCastlingRight.wks = False
+        elif move.pieceCaptured == 'bR':
+            if move.endRow == 0:
+                if move.endCol == 0:
+                    self.currentCastlingRight.bqs = False
+                elif move.endCol == 7:
+                    self.currentCastlingRight.bks = False
 
     def getValidMoves(self):
-        tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = castleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                        self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)
+        allyColour = 'w' if self.whiteToMove else 'b'
+        oppColour = 'b' if self.whiteToMove else 'w'
         # gets all move
         moves = self.getAllMoves()
         if self.whiteToMove:
@@ -153,15 +516,9 @@ class GameState():
             self.getCastleMoves(self.bKingLoc[0], self.bKingLoc[1], moves)
         # goes backwords through the list
         for i in range(len(moves) - 1, -1, -1):
-            # makes the move and changes turn
-            self.makeMove(moves[i])
-            self.whiteToMove = not self.whiteToMove
-            if self.inCheck():
-                # sees if that previous move puts the player in check
+            # sees if the move leaves the player's own king attacked
+            if self.leavesKingAttacked(moves[i], allyColour, oppColour):
                 moves.remove(moves[i])
-            # changes turn back and undoes the move
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
         # # Checks if there are any valid moves (either: stalemate or checkmate)
         if len(moves) == 0:
             # # If there are no valid moves and the king is in check it must be checkmate, If there are no valid
@@ -172,28 +529,68 @@ class GameState():
                 self.stalemate = True
 
         # all the valid moves
-        self.enpassantPossible = tempEnpassantPossible
-        self.currentCastlingRight = tempCastleRights
         return moves
 
-    def inCheck(self):
-        # checks which turn
-        if self.whiteToMove:
-            # returns a bool and checks if the whiite king is under attack
-            return self.squareUnderAttack(self.wKingLoc[0], self.wKingLoc[1])
+    def leavesKingAttacked(self, move, allyColour, oppColour):
+        # Only the board matters for whether the king is left attacked, so rather than the whole of makeMove and
+        # undoMove just the squares the move changes are set and put back. Castling moves have already been checked
+        # by getCastleMoves and only the king's square matters for them.
+        board = self.board
+        board[move.startRow][move.startCol] = '--'
+        board[move.endRow][move.endCol] = move.pieceMoved
+        if move.isEnpassantMove:
+            board[move.startRow][move.endCol] = '--'
+        if move.pieceMoved[1] == 'K':
+            kingRow, kingCol = move.endRow, move.endCol
         else:
-            # then checks black king
-            return self.squareUnderAttack(self.bKingLoc[0], self.bKingLoc[1])
+            kingRow, kingCol = self.wKingLoc if allyColour == 'w' else self.bKingLoc
+        attacked = self.squareAttackedBy(kingRow, kingCol, oppColour)
+        board[move.startRow][move.startCol] = move.pieceMoved
+        if move.isEnpassantMove:
+            board[move.endRow][move.endCol] = '--'
+            board[move.startRow][move.endCol] = move.pieceCaptured
+        else:
+            board[move.endRow][move.endCol] = move.pieceCaptured
+        return attacked
+
+    def inCheck(self):
+        # the checkers were found when the last move was made
+        return len(self.checkersLog[-1]) != 0
 
     def squareUnderAttack(self, r, c):
-        # sees opponent moves by changing turn gets all there moves and changes back turn
-        self.whiteToMove = not self.whiteToMove
-        oppMoves = self.getAllMoves()
-        self.whiteToMove = not self.whiteToMove
-        # checks all moves and sees if the end square is the square entered in the function
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:
+        # whether the opponent of the side to move attacks the square
+        return self.squareAttackedBy(r, c, 'b' if self.whiteToMove else 'w')
+
+    def squareAttackedBy(self, r, c, oppColour):
+        # looks outwards from the square using the lookup tables and sees if a piece of oppColour is sitting on a
+        # square it could attack from, rather than generating every opponent move
+        allyColour = 'b' if oppColour == 'w' else 'w'
+        board = self.board
+        for endRow, endCol in knightTargets[r][c]:
+            if board[endRow][endCol] == oppColour + 'N':
+                return True
+        for endRow, endCol in kingTargets[r][c]:
+            if board[endRow][endCol] == oppColour + 'K':
                 return True
+        # an opponent pawn attacks this square from the squares our own pawn would capture on
+        for endRow, endCol in pawnCaptures[allyColour][r][c]:
+            if board[endRow][endCol] == oppColour + 'P':
+                return True
+        # sliders, only the first piece along each ray matters
+        for ray in rookRays[r][c]:
+            for endRow, endCol in ray:
+                endPiece = board[endRow][endCol]
+                if endPiece != '--':
+                    if endPiece[0] == oppColour and (endPiece[1] == 'R' or endPiece[1] == 'Q'):
+                        return True
+                    break
+        for ray in bishopRays[r][c]:
+            for endRow, endCol in ray:
+                endPiece = board[endRow][endCol]
+                if endPiece != '--':
+                    if endPiece[0] == oppColour and (endPiece[1] == 'B' or endPiece[1] == 'Q'):
+                        return True
+                    break
         return False
 
     def getAllMoves(self):
@@ -211,136 +608,67 @@ class GameState():
         return moves
 
     def getPawnMoves(self, r, c, moves):
-        # white pawn moves
-        if self.whiteToMove:
-            # checking if square above is empty
-            if self.board[r - 1][c] == '--':
-                # if it is we append that as a valid move
-                moves.append(Move((r, c), (r - 1, c), self.board))
-                # checks if the piece hasn't been moved so it can do a double move
-                if r == 6 and self.board[r - 2][c] == '--':
-                    moves.append(Move((r, c), (r - 2, c), self.board))
-            # captures to the left        
-            if c - 1 >= 0:
-                if self.board[r - 1][c - 1][0] == 'b':
-                    moves.append(Move((r, c), (r - 1, c - 1), self.board))
-                elif (r - 1, c - 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r - 1, c - 1), self.board, isEnpassantMove=True))
-            # captures to the right
-            if c + 1 <= 7:
-                if self.board[r - 1][c + 1][0] == 'b':
-                    moves.append(Move((r, c), (r - 1, c + 1), self.board))
-                elif (r - 1, c + 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r - 1, c + 1), self.board, isEnpassantMove=True))
-
-        # black pawn moves
-        else:
-            if self.board[r + 1][c] == '--':
-                # checking if square below is empty
-                moves.append(Move((r, c), (r + 1, c), self.board))
-                # checks if the piece hasn't been moved so it can do a double move
-                if r == 1 and self.board[r + 2][c] == '--':
-                    moves.append(Move((r, c), (r + 2, c), self.board))
-            # captures to the left
-            if c - 1 >= 0:
-                if self.board[r + 1][c - 1][0] == 'w':
-                    moves.append(Move((r, c), (r + 1, c - 1), self.board))
-                elif (r + 1, c - 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r + 1, c - 1), self.board, isEnpassantMove=True))
-            # captures to the right
-            if c + 1 <= 7:
-                if self.board[r + 1][c + 1][0] == 'w':
-                    moves.append(Move((r, c), (r + 1, c + 1), self.board))
-                elif (r + 1, c + 1) == self.enpassantPossible:
-                    moves.append(Move((r, c), (r + 1, c + 1), self.board, isEnpassantMove=True))
-
-    def getRookMoves(self, r, c, moves):
-        # directions up, down, left and right(not in that order)
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
+        allyColour = 'w' if self.whiteToMove else 'b'
+        oppColour = 'b' if self.whiteToMove else 'w'
+        pushes = pawnPushes[allyColour][r][c]
+        # checking if the square in front is empty
+        if pushes and self.board[pushes[0][0]][c] == '--':
+            # if it is we append that as a valid move
+            moves.append(Move((r, c), pushes[0], self.board))
+            # the table only has a second push if the pawn hasn't been moved so it can do a double move
+            if len(pushes) == 2 and self.board[pushes[1][0]][c] == '--':
+                moves.append(Move((r, c), pushes[1], self.board))
+        # captures to the left then to the right
+        for endRow, endCol in pawnCaptures[allyColour][r][c]:
+            if self.board[endRow][endCol][0] == oppColour:
+                moves.append(Move((r, c), (endRow, endCol), self.board))
+            elif (endRow, endCol) == self.enpassantPossible:
+                moves.append(Move((r, c), (endRow, endCol), self.board, isEnpassantMove=True))
+
+    def getSlidingMoves(self, r, c, rays, moves):
         # conditional expression in order to get opponents colour
         oppColour = 'b' if self.whiteToMove else 'w'
-        # goes through each direction
-        for d in directions:
-            # loops 8 times length/width of the board as a rook can move 8 squares
-            for i in range(1, 8):
-                # adds a factor of the direction
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                # checks if the final position is off the board
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    # checks if it can move to that end square by checking if it is empty
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == '--':
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == oppColour:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break
-                    else:
-                        break
-                # breaks if it of the board
+        # goes through each direction, the rays already stop at the edge of the board
+        for ray in rays:
+            for endRow, endCol in ray:
+                # checks if it can move to that end square by checking if it is empty
+                endPiece = self.board[endRow][endCol]
+                if endPiece == '--':
+                    moves.append(Move((r, c), (endRow, endCol), self.board))
+                # if there is an opponents piece we can take it then breaks out of that direction
+                elif endPiece[0] == oppColour:
+                    moves.append(Move((r, c), (endRow, endCol), self.board))
+                    break
+                # if it is a friendly piece then you can no longer go in that direction so we be break
                 else:
                     break
 
+    def getRookMoves(self, r, c, moves):
+        # directions up, down, left and right
+        self.getSlidingMoves(r, c, rookRays[r][c], moves)
+
     def getBishopMoves(self, r, c, moves):
-        # directions the bishop ccan move in (diaganols)
-        directions = ((-1, -1), (1, -1), (1, 1), (-1, 1))
-        # gets opponents colour
-        oppColour = 'b' if self.whiteToMove else 'w'
-        # goes through the directions
-        for d in directions:
-            # iterates 8 times
-            for i in range(1, 8):
-                # multiplies the end position by i
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                # checks if the endSq is off the board
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    # if the endSq is empty it is a valid move
-                    if endPiece == '--':
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    # if there is an opponents piece we can take it then breaks out of that direction
-                    elif endPiece[0] == oppColour:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break
-                    # if it is a friendly piece then you can no longer go in that direction so we be break
-                    else:
-                        break
-                # breaks if it off the board
-                else:
-                    break
+        # directions the bishop can move in (diaganols)
+        self.getSlidingMoves(r, c, bishopRays[r][c], moves)
 
     def getQueenMoves(self, r, c, moves):
         # can move in all directions so we use the rook and bishop valid move checks
         self.getRookMoves(r, c, moves)
         self.getBishopMoves(r, c, moves)
 
-    def getKnightMoves(self, r, c, moves):
-        # knight moves
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        # gets ally colour
+    def getStepMoves(self, r, c, targets, moves):
+        # gets ally colour, anything else on the target square can be moved to or taken
         allyColour = 'w' if self.whiteToMove else 'b'
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColour:
-                    moves.append(Move((r, c), (endRow, endCol), self.board))
+        for endRow, endCol in targets:
+            if self.board[endRow][endCol][0] != allyColour:
+                moves.append(Move((r, c), (endRow, endCol), self.board))
+
+    def getKnightMoves(self, r, c, moves):
+        self.getStepMoves(r, c, knightTargets[r][c], moves)
 
     def getKingMoves(self, r, c, moves):
         # king can only move 1 square but any direction
-        directions = ((-1, -1), (1, -1), (1, 1), (-1, 1), (-1, 0), (0, -1), (1, 0), (0, 1))
-        # easier to check if the 
-        allyColour = 'w' if self.whiteToMove else 'b'
-        for d in directions:
-            endRow = r + d[0]
-            endCol = c + d[1]
-            # checks if off the board
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColour:
-                    moves.append(Move((r, c), (endRow, endCol), self.board))
+        self.getStepMoves(r, c, kingTargets[r][c], moves)
 
     def getCastleMoves(self, r, c, moves):
         if self.squareUnderAttack(r, c):
@@ -363,231 +691,553 @@ class GameState():
                 moves.append(Move((r, c), (r, c - 2), self.board, isCastleMove=True))
 
 
+    def moveFromID(self, moveID):
+        # rebuilds a move in this position from its moveID, the ID must be for a valid move
+        startSq = (moveID // 1000, moveID // 100 % 10)
+        endSq = (moveID // 10 % 10, moveID % 10)
+        piece = self.board[startSq[0]][startSq[1]]
+        # a pawn moving diagonally onto an empty square is taking enpassant and a king moving 2 squares is castling
+        isEnpassantMove = piece[1] == 'P' and startSq[1] != endSq[1] and self.board[endSq[0]][endSq[1]] == '--'
+        isCastleMove = piece[1] == 'K' and abs(startSq[1] - endSq[1]) == 2
+        return Move(startSq, endSq, self.board, isEnpassantMove=isEnpassantMove, isCastleMove=isCastleMove)
+
+    def getLeastValuableAttacker(self, r, c, colour):
+        # finds the cheapest piece of the given colour attacking the square, returns its square and piece or None
+        oppColour = 'b' if colour == 'w' else 'w'
+        board = self.board
+        # a pawn of that colour attacks the square from the squares an opponent pawn would capture on
+        for endRow, endCol in pawnCaptures[oppColour][r][c]:
+            if board[endRow][endCol] == colour + 'P':
+                return (endRow, endCol), colour + 'P'
+        for endRow, endCol in knightTargets[r][c]:
+            if board[endRow][endCol] == colour + 'N':
+                return (endRow, endCol), colour + 'N'
+        # sliders, only the first piece on each ray can attack, the cheapest one found is kept
+        attacker = None
+        attackerValue = math.inf
+        for rays, pieceTypes in ((bishopRays[r][c], 'BQ'), (rookRays[r][c], 'RQ')):
+            for ray in rays:
+                for endRow, endCol in ray:
+                    endPiece = board[endRow][endCol]
+                    if endPiece != '--':
+                        if endPiece[0] == colour and endPiece[1] in pieceTypes and \
+                                pieceValues[endPiece[1]] < attackerValue:
+                            attacker = ((endRow, endCol), endPiece)
+                            attackerValue = pieceValues[endPiece[1]]
+                        break
+        if attacker is not None:
+            return attacker
+        for endRow, endCol in kingTargets[r][c]:
+            if board[endRow][endCol] == colour + 'K':
+                return (endRow, endCol), colour + 'K'
+        return None
+
+    def staticExchange(self, move):
+        # Static exchange evaluation, plays out every capture on the end square of the move with the least valuable
+        # attacker each time and returns the material the side making the move wins (negative if it loses material)
+        r, c = move.endRow, move.endCol
+        board = self.board
+        gain = [pieceValues[move.pieceCaptured[1]] if move.pieceCaptured != '--' else 0]
+        onSquare = pieceValues[move.pieceMoved[1]]
+        if move.isPawnPromotion:
+            gain[0] += pieceValues['Q'] - pieceValues['P']
+            onSquare = pieceValues['Q']
+        # pieces that have taken part are lifted off the board so anything lined up behind them joins in,
+        # they are all put back at the end
+        lifted = [((move.startRow, move.startCol), move.pieceMoved)]
+        if move.isEnpassantMove:
+            lifted.append(((move.startRow, move.endCol), board[move.startRow][move.endCol]))
+        for (liftRow, liftCol), piece in lifted:
+            board[liftRow][liftCol] = '--'
+        colour = 'w' if move.pieceMoved[0] == 'b' else 'b'
+        while True:
+            attacker = self.getLeastValuableAttacker(r, c, colour)
+            if attacker is None:
+                break
+            (attackRow, attackCol), piece = attacker
+            # what the recapturing side gains if the exchange stopped here. The exchange is always played out to the
+            # end, cutting it short once one side is ahead only keeps the sign of the result right and orderMoves
+            # sorts on the value
+            gain.append(onSquare - gain[-1])
+            onSquare = pieceValues[piece[1]]
+            lifted.append(((attackRow, attackCol), piece))
+            board[attackRow][attackCol] = '--'
+            colour = 'w' if colour == 'b' else 'b'
+        for (liftRow, liftCol), piece in lifted:
+            board[liftRow][liftCol] = piece
+        # each side can choose to stop capturing so the result is worked out backwards from the end of the exchange
+        for i in range(len(gain) - 1, 0, -1):
+            gain[i - 1] = -max(-gain[i - 1], gain[i])
+        return gain[0]
+
+    def orderMoves(self, moves):
+        # returns (exchange value, move) pairs, captures that win material first (best first), then quiet moves,
+        # then captures that lose material
+        winning = []
+        quiet = []
+        losing = []
+        for move in moves:
+            if move.pieceCaptured != '--' or move.isPawnPromotion:
+                see = self.staticExchange(move)
+                if see >= 0:
+                    winning.append((see, move))
+                else:
+                    losing.append((see, move))
+            else:
+                quiet.append((0, move))
+        winning.sort(key=lambda pair: pair[0], reverse=True)
+        losing.sort(key=lambda pair: pair[0], reverse=True)
+        return winning + quiet + losing
+
     def minimax(self, depth, alpha, beta, isMaximiser):
-        reqDepth = copy.deepcopy(depth)
-        tempCheckmate = copy.deepcopy(self.checkMate)
-        tempStalemate = copy.deepcopy(self.stalemate)
+        if self.searchDeadline is not None and time.time() > self.searchDeadline:
+            raise SearchTimeout()
+        self.nodes += 1
+        # the principal variation found from this node, built up from the one found by the best child
+        ply = len(self.moveLog) - self.searchRootPly
+        self.pvTable[ply] = []
+
+        # a repeated position or one where the fifty move rule applies is a draw, whatever is below it
+        if self.halfmoveClockLog[-1] >= 4 and self.isSearchDraw(ply):
+            return 0
+
+        # mate distance pruning, the side to move can at best mate on the next ply and at worst be mated now, so if
+        # a quicker mate has already been found elsewhere nothing here can change the result
+        if isMaximiser:
+            if mateScore - ply - 1 <= alpha:
+                return mateScore - ply - 1
+            if ply - mateScore >= beta:
+                return ply - mateScore
+        else:
+            if ply + 1 - mateScore >= beta:
+                return ply + 1 - mateScore
+            if mateScore - ply <= alpha:
+                return mateScore - ply
+
+        # at the bottom of the branch captures are played out so the evaluation isn't taken halfway through an exchange,
+        # quiescence generates the moves (and spots checkmate and stalemate) itself
+        if depth == 0:
+            return self.quiescence(alpha, beta, isMaximiser)
+
+        tempCheckmate = self.checkMate
+        tempStalemate = self.stalemate
         moves = self.getValidMoves()
+        # checking if it is stalemate or checkmate
+        if len(moves) == 0:
+            value = self.boardEval(moves)
+            self.checkMate = tempCheckmate
+            self.stalemate = tempStalemate
+            return value
 
-        # checking if it has reached the bottom of the branch or stalemate or checkmate
-        if depth == 0 or ((self.checkMate or self.stalemate) and len(moves) == 0):
-            # gets the evaluation
-            value = self.boardEval()
-            self.checkMate = copy.deepcopy(tempCheckmate)
-            self.stalemate = copy.deepcopy(tempStalemate)
-            # returns the evaluation and reqDepth to achieve that position
-            return value, reqDepth
-
-        elif isMaximiser:
+        inCheck = self.inCheck()
+        if isMaximiser:
             maxEval = -math.inf
-            moves = self.getValidMoves()
-            for move in moves:
+            for see, move in self.orderMoves(moves):
+                # one ply from the bottom a capture that loses material isn't worth searching, losing captures are
+                # ordered last so the rest can be skipped as long as something has been searched
+                if depth == 1 and see < 0 and not inCheck and maxEval != -math.inf:
+                    break
                 self.makeMove(move)
-                eval, reqDepth = self.minimax(depth - 1, alpha, beta, False)
+                eval = self.minimax(depth - 1, alpha, beta, False)
+                if eval > maxEval or len(self.pvTable[ply]) == 0:
+                    self.pvTable[ply] = [move] + self.pvTable[ply + 1]
                 maxEval = max(maxEval, eval)
                 alpha = max(alpha, eval)
                 self.undoMove()
-                # if alpha <= beta
                 if beta <= alpha:
                     break
-            self.checkMate = copy.deepcopy(tempCheckmate)
-            self.stalemate = copy.deepcopy(tempStalemate)
-            return maxEval, reqDepth
+            return maxEval
         else:
             minEval = math.inf
-            moves = self.getValidMoves()
-            for move in moves:
+            for see, move in self.orderMoves(moves):
+                if depth == 1 and see < 0 and not inCheck and minEval != math.inf:
+                    break
                 self.makeMove(move)
-                eval, reqDepth = self.minimax(depth - 1, alpha, beta, True)
+                eval = self.minimax(depth - 1, alpha, beta, True)
+                if eval < minEval or len(self.pvTable[ply]) == 0:
+                    self.pvTable[ply] = [move] + self.pvTable[ply + 1]
                 minEval = min(minEval, eval)
                 beta = min(beta, eval)
                 self.undoMove()
-
-                # if beta <= alpha:
-                if alpha <= beta:
+                if beta <= alpha:
                     break
-            self.checkMate = copy.deepcopy(tempCheckmate)
-            self.stalemate = copy.deepcopy(tempStalemate)
-            return minEval, reqDepth
+            return minEval
 
-    def getBestMove(self, depth):
+    def quiescence(self, alpha, beta, isMaximiser):
+        self.nodes += 1
+        tempCheckmate = self.checkMate
+        tempStalemate = self.stalemate
+        moves = self.getValidMoves()
+        if len(moves) == 0:
+            value = self.boardEval(moves)
+            self.checkMate = tempCheckmate
+            self.stalemate = tempStalemate
+            return value
+
+        # the side to move can always decline to capture so the static evaluation is a lower (or upper) bound,
+        # unless it is in check in which case every way out of check is searched
+        inCheck = self.inCheck()
+        if inCheck:
+            standPat = -math.inf if isMaximiser else math.inf
+        else:
+            standPat = self.staticEval()
+            if isMaximiser:
+                if standPat >= beta:
+                    return standPat
+                alpha = max(alpha, standPat)
+            else:
+                if standPat <= alpha:
+                    return standPat
+                beta = min(beta, standPat)
+
+        bestEval = standPat
+        for see, move in self.orderMoves(moves):
+            # only captures and promotions are searched and ones that lose material are pruned, they come last
+            if not inCheck:
+                if see < 0:
+                    break
+                if move.pieceCaptured == '--' and not move.isPawnPromotion:
+                    continue
+            self.makeMove(move)
+            eval = self.quiescence(alpha, beta, not isMaximiser)
+            self.undoMove()
+            if isMaximiser:
+                bestEval = max(bestEval, eval)
+                alpha = max(alpha, eval)
+            else:
+                bestEval = min(bestEval, eval)
+                beta = min(beta, eval)
+            if beta <= alpha:
+                break
+        return bestEval
+
+    def getBestMove(self, depth, cache=None):
+        # cache is an optional AnalysisCache, a position already searched at least this deep is answered from it.
+        # The cache is keyed by the position alone so it is left out when the game's history could change the result
+        if cache is not None and self.historyMatters(depth):
+            cache = None
+        if cache is not None:
+            hashKey = self.computeHashKey()
+            entry = cache.lookup(hashKey, depth)
+            if entry is not None:
+                self.searchScore = entry[1]
+                return self.moveFromID(entry[2])
         tempCheckmate = copy.deepcopy(self.checkMate)
         tempStalemate = copy.deepcopy(self.stalemate)
         tempCastle = copy.deepcopy((self.currentCastlingRight.wks, self.currentCastlingRight.bks,
                                     self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
         self.AIturn = True
+        self.searchRootPly = len(self.moveLog)
 
-        bestScore = math.inf
+        # white wants the highest score and black the lowest, the AI can play either side
+        rootWhite = self.whiteToMove
+        winningScore = math.inf if rootWhite else -math.inf
+        bestScore = -winningScore
+        bestMove = None
         moves = self.getValidMoves()
 
+        # a move that mates straight away can't be beaten so the rest aren't searched
+        mateInOne = mateScore - 1 if rootWhite else -mateScore + 1
         for move in moves:
             self.makeMove(move)
-            initValue = self.boardEval()
-            if initValue == -math.inf:
-                bestMove = copy.deepcopy(move)
-                self.undoMove()
-                return bestMove
-
-            score, reqDepth = self.minimax(depth, -math.inf, math.inf, False)
-
-            if depth - reqDepth == 1:
-                if score == -math.inf:
-                    bestMove = copy.deepcopy(move)
-                    self.undoMove()
-                    return bestMove
-            elif depth - reqDepth == 2:
-                if score == -math.inf:
-                    bestMove = copy.deepcopy(move)
-                    self.undoMove()
-                    return bestMove
+            # the other side is to move after the AI's move, anything that can't beat the best score so far can be
+            # cut off, once a mate is found only quicker mates get past the mate distance pruning
+            if rootWhite:
+                score = self.minimax(depth, bestScore, math.inf, False)
+            else:
+                score = self.minimax(depth, -math.inf, bestScore, True)
+            self.undoMove()
 
-            if score < bestScore:
+            if bestMove is None or (rootWhite and score > bestScore) or (not rootWhite and score < bestScore):
                 bestScore = score
                 bestMove = copy.deepcopy(move)
-                self.undoMove()
-            else:
-                self.undoMove()
+            if bestScore == mateInOne:
+                break
 
+        self.searchScore = bestScore
         self.AIturn = False
         self.checkMate = copy.deepcopy(tempCheckmate)
         self.stalemate = copy.deepcopy(tempStalemate)
         self.currentCastlingRight = castleRights(tempCastle[0], tempCastle[1], tempCastle[2], tempCastle[3])
 
+        if cache is not None and bestMove is not None:
+            cache.store(hashKey, depth, bestScore, bestMove.moveID)
         return bestMove
 
-    def boardEval(self):
-        moves = self.getValidMoves()
-        if len(moves) == 0:
+    def getTimedBestMove(self, timeLimit, maxDepth=6, cache=None):
+        # iterative deepening, getBestMove is run at depth 0, 1, 2, ... and the move from the deepest search that
+        # finishes within timeLimit seconds is returned. Depth 0 is never timed so there is always a move.
+        tempCheckmate = self.checkMate
+        tempStalemate = self.stalemate
+        tempAIturn = self.AIturn
+        tempCastle = (self.currentCastlingRight.wks, self.currentCastlingRight.bks,
+                      self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)
+        bestMove = self.getBestMove(0, cache)
+        self.searchDeadline = time.time() + timeLimit
+        try:
+            for depth in range(1, maxDepth + 1):
+                bestMove = self.getBestMove(depth, cache)
+                # every shorter line has been searched so once the side to move can mate a deeper search won't find
+                # a quicker one
+                mate = scoreToMate(self.searchScore)
+                if mate is not None and (mate > 0) == self.whiteToMove:
+                    break
+        except SearchTimeout:
+            # the search was stopped part way down a branch so every move it made is taken back
+            while len(self.moveLog) > self.searchRootPly:
+                self.undoMove()
+        finally:
+            self.searchDeadline = None
+        self.AIturn = tempAIturn
+        self.checkMate = tempCheckmate
+        self.stalemate = tempStalemate
+        self.currentCastlingRight = castleRights(tempCastle[0], tempCastle[1], tempCastle[2], tempCastle[3])
+        return bestMove
 
+    def analyse(self, depth, multiPV=3):
+        # Generator for analysis, searches every root move at depth 0, 1, ... up to depth (the same depth as
+        # getBestMove, not counting the root move) and after each one yields (depth, lines) where lines holds the best
+        # multiPV (score, principal variation) pairs for the side to move, best first. The caller can stop early by
+        # breaking out of the loop, the position is left as it was either way.
+        tempCheckmate = self.checkMate
+        tempStalemate = self.stalemate
+        tempAIturn = self.AIturn
+        self.AIturn = True
+        self.searchRootPly = len(self.moveLog)
+        # white wants the highest score and black the lowest
+        rootWhite = self.whiteToMove
+        try:
+            moves = [move for see, move in self.orderMoves(self.getValidMoves())]
+            for currentDepth in range(depth + 1):
+                lines = []
+                for move in moves:
+                    # once there are multiPV lines a move only has to be searched far enough to show that it is
+                    # worse than the last of them, its score is then only a bound but it is only used for ordering
+                    if len(lines) >= multiPV:
+                        lines.sort(key=lambda line: line[0], reverse=rootWhite)
+                        cutoff = lines[multiPV - 1][0]
+                    else:
+                        cutoff = -math.inf if rootWhite else math.inf
+                    self.makeMove(move)
+                    if rootWhite:
+                        score = self.minimax(currentDepth, cutoff, math.inf, False)
+                    else:
+                        score = self.minimax(currentDepth, -math.inf, cutoff, True)
+                    lines.append((score, [move] + self.pvTable[1]))
+                    self.undoMove()
+                lines.sort(key=lambda line: line[0], reverse=rootWhite)
+                # the next depth searches the moves in the order this one ranked them
+                moves = [line[1][0] for line in lines]
+                yield currentDepth, lines[:multiPV]
+        finally:
+            self.AIturn = tempAIturn
+            self.checkMate = tempCheckmate
+            self.stalemate = tempStalemate
+
+    def boardEval(self, moves=None):
+        # a checkmate is scored by how many plies into the search it happens (see mateScore). moves are the valid
+        # moves if the caller has already generated them
+        if moves is None:
+            moves = self.getValidMoves()
+        if len(moves) == 0:
+            ply = len(self.moveLog) - self.searchRootPly
             if self.whiteToMove and self.checkMate:
-                self.printBoard()
-                self.printLog()
-                print("Black checkmate")
-                return -math.inf
-            elif self.whiteToMove and self.checkMate:
-                print("White checkmate")
-                return math.inf
+                return -mateScore + ply
+            elif not self.whiteToMove and self.checkMate:
+                return mateScore - ply
             elif self.stalemate:
                 return 0
-        # Pawns
-        wPpieceSquare = [[0, 0, 0, 0, 0, 0, 0, 0],
-                         [50, 50, 50, 50, 50, 50, 50, 50],
-                         [10, 10, 20, 25, 25, 20, 10, 10],
-                         [5, 5, 10, 100, 100 , 10, 5, 5],
-                         [3, 3, 10, 100, 100, 10, 3, 3],
-                         [5, -5, -10, 0, 60, -10, -5, 5],
-                         [5, 10, 10, 10, 10, 10, 10, 5],
-                         [0, 0, 0, 0, 0, 0, 0, 0]]
-
-        # Knights
-        wNpieceSquare = [[-50, -40, -30, -30, -30, -30, -40, -50],
-                         [-40, -20, 0, 0, 0, 0, -20, -40],
-                         [-30, 20, 0, 0, 0, 0, 20, -30],
-                         [-30, 5, 5, 5, 5, 5, 5, -30],
-                         [-30, 5, 5, 5, 5, 5, 5, -30],
-                         [-30, 20, 20, 10, 10, 20, 20, -30],
-                         [-40, -20, 0, 20, 20, 0, -20, -40],
-                         [-50, -40, -30, -30, -30, -30, -40, -50]]
-
-        # Bishops
-        wBpieceSquare = [[-20, -10, -10, -10, -10, -10, -10, -20],
-                         [-10, 0, 0, 0, 0, 0, 0, -10],
-                         [-10, 0, 5, 10, 10, 5, 0, -10],
-                         [-10, 5, 5, 10, 10, 5, 5, -10],
-                         [-10, 0, 10, 10, 10, 10, 0, -10],
-                         [-10, 10, 10, 10, 10, 10, 10, -10],
-                         [-10, 5, 0, 0, 0, 0, 5, -10],
-                         [-20, -10, -10, -10, -10, -10, -10, -20]]
-
-        # Rooks
-        wRpieceSquare = [[0, 0, 0, 0, 0, 0, 0, 0],
-                         [5, 10, 10, 10, 10, 10, 10, 5],
-                         [-5, 0, 0, 0, 0, 0, 0, -5],
-                         [-5, 0, 0, 0, 0, 0, 0, -5],
-                         [-5, 0, 0, 0, 0, 0, 0, -5],
-                         [-5, 0, 0, 0, 0, 0, 0, -5],
-                         [-5, 0, 0, 0, 0, 0, 0, -5],
-                         [0, 0, 0, 5, 5, 0, 0, 0]]
-
-        # Queens
-        wQpieceSquare = [[-20, -10, -10, -5, -5, -10, -10, -20],
-                         [-10, 0, 0, 0, 0, 0, 0, -10],
-                         [-10, 0, 5, 5, 5, 5, 0, -10],
-                         [-5, 0, 5, 5, 5, 5, 0, -5],
-                         [0, 0, 5, 5, 5, 5, 0, -5],
-                         [-10, 5, 5, 5, 5, 5, 0, -10],
-                         [-10, 0, 5, 0, 0, 0, 0, -10],
-                         [-20, -10, -10, -5, -5, -10, -10, -20]]
-
-        # King
-        wKpieceSquare = [[-30, -40, -40, -50, -50, -40, -40, -30],
-                         [-30, -40, -40, -50, -50, -40, -40, -30],
-                         [-30, -40, -40, -50, -50, -40, -40, -30],
-                         [-30, -40, -40, -50, -50, -40, -40, -30],
-                         [-20, -30, -30, -40, -40, -30, -30, -20],
-                         [-10, -20, -20, -20, -20, -20, -20, -10],
-                         [20, 20, 0, -10, -10, -10, 20, 40],
-                         [30, 50, 40, -10, 0, 20, 50, 30]]
-
-        bPpieceSquare = self.reversePiece(wPpieceSquare)
-        bNpieceSquare = self.reversePiece(wNpieceSquare)
-        bBpieceSquare = self.reversePiece(wBpieceSquare)
-        bRpieceSquare = self.reversePiece(wRpieceSquare)
-        bQpieceSquare = self.reversePiece(wQpieceSquare)
-        bKpieceSquare = self.reversePiece(wKpieceSquare)
-
-        values = {'wP': 100, 'wR': 500, 'wN': 300, 'wB': 300, 'wQ': 900, 'wK': 20000,
-                  'bP': -100, 'bR': -500, 'bN': -300, 'bB': -300, 'bQ': -900, 'bK': -20000}
+        return self.staticEval()
+
+    def staticEval(self):
+        # material and piece square score without checking for checkmate or stalemate
         score = 0
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                piece = self.board[r][c]
+        for r in range(8):
+            row = self.board[r]
+            for c in range(8):
+                piece = row[c]
                 if piece != '--':
-                    score += values[self.board[r][c]]
-                    # Pawns
-                    if piece == 'wP':
-                        score += wPpieceSquare[r][c]
-                    elif piece == 'bP':
-                        score += bPpieceSquare[r][c]
-                    # Knights
-                    elif piece == 'wN':
-                        score += wNpieceSquare[r][c]
-                    elif piece == 'bN':
-                        score += bNpieceSquare[r][c]
-                    # Bishops
-                    elif piece == 'wB':
-                        score += wBpieceSquare[r][c]
-                    elif piece == 'bB':
-                        score += bBpieceSquare[r][c]
-                    # Rooks
-                    elif piece == 'wR':
-                        score += wRpieceSquare[r][c]
-                    elif piece == 'bR':
-                        score += bRpieceSquare[r][c]
-                    # Queens
-                    elif piece == 'wQ':
-                        score += wQpieceSquare[r][c]
-                    elif piece == 'bQ':
-                        score += bQpieceSquare[r][c]
-                    # Kings
-                    elif piece == 'wK':
-                        score += wKpieceSquare[r][c]
-                    elif piece == 'bK':
-                        score += bKpieceSquare[r][c]
-
+                    score += materialValues[piece] + pieceSquareTables[piece][r][c]
+        score += self.pawnStructureEval()
         return score
-        print(score)
 
+    def computePawnKey(self):
+        # hash of where the pawns are and nothing else, built up from scratch
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c][1:] == 'P':
+                    key ^= zobristPieces[self.board[r][c]][r][c]
+        return key
 
-    def reversePiece(self, l):
-        newList = []
-        for row in l:
-            newList.insert(0, row)
+    def computeHashKey(self):
+        # hash of the whole position, the same position always gets the same key in every process
+        key = 0
         for r in range(8):
             for c in range(8):
-                newList[r][c] = newList[r][c] * -1
+                if self.board[r][c] != '--':
+                    key ^= zobristPieces[self.board[r][c]][r][c]
+        if not self.whiteToMove:
+            key ^= zobristBlackToMove
+        rights = (self.currentCastlingRight.wks, self.currentCastlingRight.bks,
+                  self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)
+        for i in range(4):
+            if rights[i]:
+                key ^= zobristCastling[i]
+        if self.enpassantPossible != ():
+            key ^= zobristEnpassant[self.enpassantPossible[1]]
+        return key
+
+    def pawnStructureEval(self):
+        # the pawn structure only changes on pawn moves and pawn captures so the score is cached against the pawn key,
+        # each slot of the table keeps the key it was stored with so a clash is just a miss
+        key = self.pawnKeyLog[-1]
+        index = key % pawnHashSize
+        entry = self.pawnHashTable[index]
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        score = self.getPawnStructureScore()
+        self.pawnHashTable[index] = (key, score)
+        return score
+
+    def getPawnStructureScore(self):
+        # rows of each sides pawns on every file
+        wFiles = [[] for c in range(8)]
+        bFiles = [[] for c in range(8)]
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] == 'wP':
+                    wFiles[c].append(r)
+                elif self.board[r][c] == 'bP':
+                    bFiles[c].append(r)
+        score = 0
+        for c in range(8):
+            adjacentFiles = [f for f in (c - 1, c + 1) if 0 <= f < 8]
+            # doubled pawns, every pawn after the first on a file
+            if len(wFiles[c]) > 1:
+                score -= doubledPawnPenalty * (len(wFiles[c]) - 1)
+            if len(bFiles[c]) > 1:
+                score += doubledPawnPenalty * (len(bFiles[c]) - 1)
+            # isolated pawns have no friendly pawns on the files either side
+            if not any(wFiles[f] for f in adjacentFiles):
+                score -= isolatedPawnPenalty * len(wFiles[c])
+            if not any(bFiles[f] for f in adjacentFiles):
+                score += isolatedPawnPenalty * len(bFiles[c])
+            # passed pawns have no opponent pawns in front of them on the same file or the files either side
+            for r in wFiles[c]:
+                if not any(oppRow < r for f in adjacentFiles + [c] for oppRow in bFiles[f]):
+                    score += passedPawnBonus[r]
+            for r in bFiles[c]:
+                if not any(oppRow > r for f in adjacentFiles + [c] for oppRow in wFiles[f]):
+                    score -= passedPawnBonus[7 - r]
+        return score
 
-        return newList
+    def getHalfmoveClock(self):
+        # moves since the last pawn move or capture
+        return self.halfmoveClockLog[-1]
+
+    def repetitions(self, searchPly=None):
+        # How many times the current position has been seen before. Only positions since the last pawn move or
+        # capture can be the same and the same side has to be to move, so every other key is checked going back.
+        # With searchPly (the ply of a node in the search) it returns early with 2 as soon as the repeat is inside
+        # the search, one repeat along the line being searched is as good as a draw.
+        key = self.hashKeyLog[-1]
+        last = len(self.hashKeyLog) - 1
+        earliest = max(0, last - self.halfmoveClockLog[-1])
+        count = 0
+        for i in range(last - 4, earliest - 1, -2):
+            if self.hashKeyLog[i] == key:
+                if searchPly is not None and i >= last - searchPly:
+                    return 2
+                count += 1
+        return count
+
+    def historyMatters(self, depth):
+        # whether a search depth deep from here (getBestMove's depth, minimax looks depth + 1 plies ahead) could find a
+        # draw that depends on how the game got here rather than on the position alone. The fifty move rule can if the
+        # clock is close enough to 100. A repetition can only if a position was already seen twice before the root, a
+        # repeat inside the search is a draw either way (see repetitions).
+        clock = self.halfmoveClockLog[-1]
+        if clock + depth + 1 >= 100:
+            return True
+        last = len(self.hashKeyLog) - 1
+        earlier = self.hashKeyLog[max(0, last - clock):last]
+        return len(set(earlier)) != len(earlier)
+
+    def isSearchDraw(self, ply):
+        # the fifty move rule doesn't apply when the hundredth move was checkmate
+        if self.halfmoveClockLog[-1] >= 100:
+            if not self.inCheck():
+                return True
+            tempCheckmate = self.checkMate
+            tempStalemate = self.stalemate
+            hasMoves = len(self.getValidMoves()) != 0
+            self.checkMate = tempCheckmate
+            self.stalemate = tempStalemate
+            return hasMoves
+        return self.repetitions(ply) >= 2
+
+    def getDrawReason(self):
+        # for the game rather than the search, 'threefold repetition', 'fifty move rule' or None. Checkmate on the
+        # hundredth move wins so check for checkmate (getValidMoves) first.
+        if self.repetitions() >= 2:
+            return 'threefold repetition'
+        if self.halfmoveClockLog[-1] >= 100 and not self.checkMate:
+            return 'fifty move rule'
+        return None
+
+    def toBytes(self):
+        # Packs the position into positionSize bytes: the 64 squares as 4 bit piece codes (row 0 first, two squares
+        # per byte), a flags byte (white to move then the wks, bks, wqs, bqs castling rights), the enpassant square
+        # (row * 8 + col, or 255 for none), the halfmove clock and the fullmove number.
+        codes = [pieceCodes[piece] for row in self.board for piece in row]
+        flags = (self.whiteToMove | self.currentCastlingRight.wks << 1 | self.currentCastlingRight.bks << 2 |
+                 self.currentCastlingRight.wqs << 3 | self.currentCastlingRight.bqs << 4)
+        enpassant = 255 if self.enpassantPossible == () else self.enpassantPossible[0] * 8 + self.enpassantPossible[1]
+        fullmove = (self.startPly + len(self.moveLog)) // 2 + 1
+        return bytes(codes[i] << 4 | codes[i + 1] for i in range(0, 64, 2)) + \
+            positionTail.pack(flags, enpassant, min(self.getHalfmoveClock(), 255), fullmove)
+
+    def fromBytes(self, data, history=()):
+        # Sets this GameState to the position packed by toBytes. The move log starts empty so moves played before
+        # the position can't be undone, history is passed on to setPosition.
+        board = [['--'] * 8 for r in range(8)]
+        for i in range(32):
+            r, c = divmod(2 * i, 8)
+            board[r][c] = codePieces[data[i] >> 4]
+            board[r][c + 1] = codePieces[data[i] & 15]
+        flags, enpassant, halfmoveClock, fullmove = positionTail.unpack_from(data, 32)
+        castling = (bool(flags & 2), bool(flags & 4), bool(flags & 8), bool(flags & 16))
+        enpassantSquare = () if enpassant == 255 else divmod(enpassant, 8)
+        return self.setPosition(board, bool(flags & 1), castling, enpassantSquare, halfmoveClock, fullmove, history)
+
+    def setPosition(self, board, whiteToMove, castling=(False, False, False, False), enpassant=(), halfmoveClock=0,
+                    fullmove=1, history=()):
+        # Sets this GameState to any position, castling is the (wks, bks, wqs, bqs) rights. The move log starts empty
+        # so moves played before the position can't be undone. history is the hash keys of the positions before this
+        # one (oldest first, see hashKeyLog) so repetitions of them are still noticed.
+        self.board = [list(row) for row in board]
+        self.whiteToMove = whiteToMove
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] == 'wK':
+                    self.wKingLoc = (r, c)
+                elif self.board[r][c] == 'bK':
+                    self.bKingLoc = (r, c)
+        self.enpassantPossible = enpassant
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.currentCastlingRight = castleRights(castling[0], castling[1], castling[2], castling[3])
+        self.castleRightsLog = [castleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
+                                             self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
+        self.moveLog = []
+        self.startPly = (fullmove - 1) * 2 + (not self.whiteToMove)
+        self.pawnKeyLog = [self.computePawnKey()]
+        self.checkersLog = [self.getCheckers()]
+        self.hashKeyLog = list(history) + [self.computeHashKey()]
+        self.halfmoveClockLog = [halfmoveClock]
+        self.checkMate = False
+        self.stalemate = False
+        return self
 
     def printBoard(self):
         for x in range(8):
@@ -598,6 +1248,39 @@ class GameState():
             print(x.moveID)
 
 
+def encodePositions(states):
+    # packs many GameStates into one buffer, position i is at bytes i * positionSize to (i + 1) * positionSize
+    return b''.join(gs.toBytes() for gs in states)
+
+
+def decodePositions(buffer):
+    # yields a GameState for each position packed by encodePositions
+    for offset in range(0, len(buffer), positionSize):
+        yield GameState().fromBytes(buffer[offset:offset + positionSize])
+
+
+def scoreToMate(score):
+    # the number of moves to the mate a score stands for, positive when white mates and negative when black mates,
+    # or None if it isn't a mate score. Mate in 1 is a single move by the side that mates.
+    if score is None or abs(score) < mateScore - maxMatePly:
+        return None
+    moves = (mateScore - abs(score) + 1) // 2
+    return moves if score > 0 else -moves
+
+
+def describeScore(score):
+    # e.g. "+0.35" in pawns for white, or "white mates in 3"
+    mate = scoreToMate(score)
+    if mate is not None:
+        return "%s mates in %d" % ('white' if mate > 0 else 'black', abs(mate))
+    return "%+.2f" % (score / 100)
+
+
+class SearchTimeout(Exception):
+    # raised inside minimax when a timed search runs out of time
+    pass
+
+
 class castleRights():
 
     def __init__(self, wks, bks, wqs, bqs):
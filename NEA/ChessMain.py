@@ -1,3 +1,7 @@
+import time
+# taken before anything else is imported so the startup time reported includes loading pygame and the engine
+startTime = time.perf_counter()
+
 import ChessEngine
 import Puzzles
 import pygame
@@ -11,20 +15,23 @@ width = height = 500
 dim = 8 #Dimensions (8x8)
 sqsize =  50      ##height // dim
 maxfps = 60
+# length of a puzzle rush in seconds and the number of wrong moves that ends it
+rushTime = 180
+rushMistakes = 3
 
 images = {}
 # defines an empty dictionary which can be used to Load the Images into by
 # giving each piece a name like "pW" and the corrosponding key of the image
 
-mainClock = pygame.time.Clock()
-pygame.init()
-pygame.display.set_caption("James' Chess Game")
-screen = pygame.display.set_mode((500, 500), 0, 32)
-smallfont = pygame.font.SysFont('freesansbold.ttf', 30)
-midfont = pygame.font.SysFont('freesansbold.ttf', 40)
-bigfont = pygame.font.SysFont('freesansbold.ttf', 50)
-
-keyPressed = pygame.key.get_pressed()
+# The window and fonts are only set up when they are first needed (initDisplay) so importing this file is quick and
+# doesn't open a window. Fonts are pygame's built in font (freesansbold) at these sizes, text is rendered once and
+# kept in textCache.
+screen = None
+fontSizes = {'small': 30, 'mid': 40, 'big': 50}
+fonts = {}
+textCache = {}
+# the cache is emptied when it gets this big, the puzzle rush clock makes a new bit of text every second
+maxCachedText = 256
 
 #Colours RGB format
 black = (0, 0, 0)
@@ -35,93 +42,111 @@ lightred = (255, 204, 203)
 green = (0, 255, 0)
 backgroundblue = (0, 20, 50)
 
+def initDisplay():
+    # only the display and font modules are started, pygame.init() would also start sound and joysticks
+    global screen
+    if screen is None:
+        pygame.display.init()
+        pygame.font.init()
+        pygame.display.set_caption("James' Chess Game")
+        screen = pygame.display.set_mode((width, height), 0, 32)
+    return screen
+
+def getFont(size):
+    if size not in fonts:
+        fonts[size] = pygame.font.Font(None, fontSizes[size])
+    return fonts[size]
+
+def renderText(text, size, color):
+    key = (text, size, color)
+    if key not in textCache:
+        if len(textCache) >= maxCachedText:
+            textCache.clear()
+        textCache[key] = getFont(size).render(text, True, color)
+    return textCache[key]
+
+def reportStartup():
+    # printed once, when the first menu has been drawn
+    global startTime
+    if startTime is not None:
+        print("Started in %.0f ms" % ((time.perf_counter() - startTime) * 1000))
+        startTime = None
+
 # file name for each piece must follow the formatting "wP" + .png as
 # I have used an iteration through the list "pieces" + .png to initialse each image for each piece
 def loadImages():
+    if images:
+        return
     pieces = ["wP","wR","wN","wB","wQ","wK","bP","bR","bN","bB","bQ","bK"]
     for piece in pieces:
         images[piece] = pygame.transform.scale(pygame.image.load("images/" + piece +".png"),(sqsize,sqsize))
 
-def draw_text(text, font, color, surface, x, y):
-    textobj = font.render(text, 1, color)
-    textrect = textobj.get_rect()
-    textrect.topleft = (x, y)
-    surface.blit(textobj, textrect)
-
-def main_menu():
-   while True:
-
-        screen.fill(backgroundblue)
-        button_main = (50, 300, 200, 50)
-        button_main_center = (55, 315)
-        button_puzzle  = (300, 300, 150, 50)
-        button_puzzle_center = (320, 312)
-        button_quit = (50, 450, 75, 30)
-        button_quit_center = (65, 455)
-        draw_text("James' Chess Game", bigfont, white, screen, 85, 50)
-
-        mouse = pygame.mouse.get_pos()
-
-        width = screen.get_width()
-        height = screen.get_height()
-        textchessmain = smallfont.render('Chess vs Computer', True, white)
-        textpuzzle = midfont.render('Puzzles', True, white)
-        textquit = smallfont.render('Quit', True, white)
-
-        click = False
-
-        for event in pygame.event.get():
-            if event.type == QUIT:
+def draw_text(text, size, color, surface, x, y):
+    surface.blit(renderText(text, size, color), (x, y))
+
+def buttonAt(buttons, pos):
+    # index of the button under pos, or None
+    for i, (rect, text, size, textPos, action) in enumerate(buttons):
+        if rect[0] + rect[2] >= pos[0] >= rect[0] and rect[1] + rect[3] >= pos[1] >= rect[1]:
+            return i
+    return None
+
+def drawMenu(title, titlePos, buttons, hovered):
+    screen.fill(backgroundblue)
+    draw_text(title, 'big', white, screen, titlePos[0], titlePos[1])
+    for i, (rect, text, size, textPos, action) in enumerate(buttons):
+        pygame.draw.rect(screen, green if i == hovered else red, rect)
+        screen.blit(renderText(text, size, white), textPos)
+    pygame.display.update()
+
+def runMenu(title, titlePos, buttons, escapeQuits):
+    # Shows a menu until one of its buttons with no action is clicked (or escape is pressed when escapeQuits is
+    # False). Each button is (rect, text, font size, text position, action), action being the function to call.
+    # The menu waits for events rather than redrawing every frame, it is only drawn again when the button under the
+    # mouse changes or after coming back from a button's action.
+    initDisplay()
+    hovered = buttonAt(buttons, pygame.mouse.get_pos())
+    drawMenu(title, titlePos, buttons, hovered)
+    reportStartup()
+    while True:
+        event = pygame.event.wait()
+        redraw = False
+        if event.type == QUIT:
+            pygame.quit()
+            sys.exit()
+        elif event.type == KEYDOWN and event.key == K_ESCAPE:
+            if escapeQuits:
                 pygame.quit()
                 sys.exit()
-            if event.type == KEYDOWN:
-                if event.key == K_ESCAPE:
-                   pygame.quit()
-                   sys.exit()
-            if event.type == MOUSEBUTTONDOWN:
-                if event.button == 1:
-                   click = True
-
-        # Button to activate Chess Main
-        if 50 + 200 >= mouse[0] >= 50 and 300 + 50 >= mouse[1] >= 300:
-            pygame.draw.rect(screen, green, (button_main))
-            screen.blit(textchessmain, (button_main_center))
-            if click:
-                main()
-        else:
-            pygame.draw.rect(screen, red, (button_main))
-            screen.blit(textchessmain, (button_main_center))
-
-        # Button to Activate Puzzles
-        if 300 + 150 >= mouse[0] >= 300 and 300 + 50 >= mouse[1] >= 300:
-            pygame.draw.rect(screen, green, button_puzzle)
-            screen.blit(textpuzzle, (button_puzzle_center))
-            if click:
-                puzzles()
-        else:
-            pygame.draw.rect(screen, red, button_puzzle)
-            screen.blit(textpuzzle, (button_puzzle_center))
-
-        # Button to Quit the Game
-        if 50 + 75 >= mouse[0] >= 50 and 450 + 30 >= mouse[1] >= 450:
-            pygame.draw.rect(screen, green, button_quit)
-            screen.blit(textquit, (button_quit_center))
-            if click:
-                sys.exit()
-                Running = False
-        else:
-            pygame.draw.rect(screen, red, button_quit)
-            screen.blit(textquit, (button_quit_center))
+            return
+        elif event.type == MOUSEMOTION:
+            redraw = buttonAt(buttons, event.pos) != hovered
+        elif event.type == MOUSEBUTTONDOWN and event.button == 1:
+            clicked = buttonAt(buttons, event.pos)
+            if clicked is not None:
+                action = buttons[clicked][4]
+                if action is None:
+                    return
+                action()
+                redraw = True
+        elif event.type in (VIDEOEXPOSE, WINDOWEXPOSED):
+            redraw = True
+        if redraw:
+            hovered = buttonAt(buttons, pygame.mouse.get_pos())
+            drawMenu(title, titlePos, buttons, hovered)
+
+def quitGame():
+    pygame.quit()
+    sys.exit()
 
-        if keyPressed[pygame.K_ESCAPE]:
-            print("Thanks for Playing")
-            Running = False
-
-        pygame.display.update()
-        mainClock.tick(60)
+def main_menu():
+    buttons = [((50, 300, 200, 50), 'Chess vs Computer', 'small', (55, 315), main),
+               ((300, 300, 150, 50), 'Puzzles', 'mid', (320, 312), puzzlesmenu),
+               ((50, 450, 75, 30), 'Quit', 'small', (65, 455), quitGame)]
+    runMenu("James' Chess Game", (85, 50), buttons, True)
 
 def main():
-    screen = pygame.display.set_mode((width,height))
+    screen = initDisplay()
     clock = pygame.time.Clock()
     screen.fill(pygame.Color("White"))
 
@@ -187,114 +212,155 @@ def main():
             print("Draw by stalemate")
             running = False
 
-        if not gs.whiteToMove and len(validMoves) != 0 and not moveMade:
+        if not gs.checkMate and not gs.AIturn and gs.getDrawReason() is not None:
+            print("Draw by " + gs.getDrawReason())
+            running = False
+
+        if running and not gs.whiteToMove and len(validMoves) != 0 and not moveMade:
             x = gs.getBestMove(2)
             gs.makeMove(x)
             moveMade = True
 
 def puzzlesmenu():
-    while True:
-
-        screen.fill(backgroundblue)
-        pygame.display.update()
-        button_puzzle1 = (50, 300, 200, 50)
-        button_puzzle1_center = (55, 315)
-        button_puzzle2 = (300, 300, 150, 50)
-        button_puzzle2_center = (320, 312)
-        button_back = (50, 450, 75, 30)
-        button_back_center = (65, 455)
-
-        mouse = pygame.mouse.get_pos()
-
-        width = screen.get_width()
-        height = screen.get_height()
-
-        textpuzzle1 = midfont.render('Puzzle 1', True, white)
-        textpuzzle2 = midfont.render('Puzzle 2', True, white)
-        textback = smallfont.render('back', True, white)
-
-        click = False
-
-        if 50 + 200 >= mouse[0] >= 50 and 300 + 50 >= mouse[1] >= 300:
-            pygame.draw.rect(screen, green, (button_puzzle1))
-            screen.blit(textpuzzle1, (button_puzzle1_center))
-        if click:
-            puzzlesmenu()
-        else:
-            pygame.draw.rect(screen, red, (button_puzzle1))
-            screen.blit(textpuzzle1, (button_puzzle1_center))
-
-        if 300 + 150 >= mouse[0] >= 300 and 300 + 50 >= mouse[1] >= 300:
-            pygame.draw.rect(screen, green, button_puzzle2)
-            screen.blit(textpuzzle2, (button_puzzle2_center))
-            if click:
-                puzzlesmenu()
-        else:
-            pygame.draw.rect(screen, red, button_puzzle2)
-            screen.blit(textpuzzle2, (button_puzzle2_center))
-
-        if 50 + 75 >= mouse[0] >= 50 and 450 + 30 >= mouse[1] >= 450:
-            pygame.draw.rect(screen, green, button_back)
-            screen.blit(textback, (button_back_center))
-            if click:
-                sys.exit()
-        else:
-            pygame.draw.rect(screen, red, button_back)
-            screen.blit(textback, (button_back_center))
-
-        pygame.display.update()
-        mainClock.tick(60)
-
-def puzzles():
-    screen = pygame.display.set_mode((width, height))
-    clock = pygame.time.Clock()
+    # the puzzles in two columns of buttons, then puzzle rush and back
+    puzzleSet = Puzzles.loadPuzzles()
+    buttons = []
+    for i, puzzle in enumerate(puzzleSet):
+        x = 30 + (i % 2) * 230
+        y = 100 + (i // 2) * 50
+        buttons.append(((x, y, 210, 35), "%s (%d)" % (puzzle.name, puzzle.mateIn), 'small', (x + 8, y + 8),
+                        lambda puzzle=puzzle: puzzles(puzzle)))
+    buttons.append(((300, 440, 160, 40), 'Puzzle Rush', 'small', (318, 450), lambda: puzzleRush(puzzleSet)))
+    buttons.append(((50, 450, 75, 30), 'back', 'small', (65, 455), None))
+    runMenu("Puzzles", (180, 30), buttons, False)
+
+def puzzleClick(session, validMoves, sqSelected, playerClicks):
+    # handles a click on the board of a puzzle, returns the new sqSelected and playerClicks
+    location = pygame.mouse.get_pos()
+    col = location[0] // sqsize
+    row = location[1] // sqsize
+    if row >= dim or col >= dim:
+        return (), []
+    if sqSelected == (row, col):
+        return (), []
+    sqSelected = (row, col)
+    playerClicks = playerClicks + [sqSelected]
+    if len(playerClicks) == 2:
+        move = ChessEngine.Move(playerClicks[0], playerClicks[1], session.gs.board)
+        for validMove in validMoves:
+            if move == validMove:
+                # checked against the solution, the defender's reply is played straight away
+                session.tryMove(validMove)
+                return (), []
+        return sqSelected, [sqSelected]
+    return sqSelected, playerClicks
+
+def drawPuzzle(screen, session, lines):
     screen.fill(pygame.Color("White"))
+    drawGameState(screen, session.gs)
+    for i, line in enumerate(lines):
+        draw_text(line, 'small', black, screen, 10, dim * sqsize + 10 + i * 28)
 
-    gs = Puzzles.GameStatePuzzles()
-    solution = ((1,7), (1,0), gs.board)
-    moveMade = False
+def puzzles(puzzle):
+    screen = initDisplay()
+    clock = pygame.time.Clock()
     loadImages()
+
+    session = Puzzles.PuzzleSession(puzzle)
+    validMoves = session.gs.getValidMoves()
     sqSelected = ()
     playerClicks = []
-    running = True
-
-    while running:
+    wrongMove = False
+    while True:
         for e in pygame.event.get():
             if e.type == pygame.QUIT:
-                running = False
-                print(gs.moveLog)
-
-            elif e.type == pygame.MOUSEBUTTONDOWN and gs.whiteToMove:
-                location = pygame.mouse.get_pos()
-                col = location[0] // sqsize
-                row = location[1] // sqsize
-                if sqSelected == (row, col):
-                    sqSelected = ()
-                    playerClicks = []
-                else:
-                    sqSelected = (row, col)
-                    playerClicks.append(sqSelected)
-
-                if len(playerClicks) == 2:
-                    move = Puzzles.Move(playerClicks[0], playerClicks[1], gs.board)
-                    if move == solution:
-                        gs.makeMove(solution)
-                        moveMade = True
-                        sqSelected = ()
-                        playerClicks = []
-                    if not moveMade:
-                        playerClicks = [sqSelected]
-
-
+                return
+            elif e.type == pygame.MOUSEBUTTONDOWN:
+                if session.playerToMove():
+                    sqSelected, playerClicks = puzzleClick(session, validMoves, sqSelected, playerClicks)
+                    validMoves = session.gs.getValidMoves()
+                elif session.solved:
+                    return
             elif e.type == pygame.KEYDOWN:
                 if e.key == K_ESCAPE:
                     pygame.quit()
                     sys.exit()
-
-        drawGameState(screen, gs)
+                elif session.solved:
+                    return
+
+        if session.failed:
+            # a wrong move starts the puzzle again
+            session = Puzzles.PuzzleSession(puzzle)
+            validMoves = session.gs.getValidMoves()
+            wrongMove = True
+        if wrongMove and not session.solved:
+            message = "Wrong move, try again"
+        elif session.solved:
+            message = "Solved! Click to go back"
+        else:
+            message = "%s to move and mate in %d" % ('White' if session.gs.whiteToMove else 'Black', puzzle.mateIn)
+        drawPuzzle(screen, session, [puzzle.name, message])
         clock.tick(maxfps)
         pygame.display.flip()
 
+def puzzleRush(puzzleSet):
+    # as many puzzles as possible in rushTime seconds, a wrong move moves on to the next puzzle and rushMistakes
+    # wrong moves end the rush. The next puzzles are solved in the background while the player is thinking.
+    screen = initDisplay()
+    clock = pygame.time.Clock()
+    loadImages()
+
+    prefetcher = Puzzles.PuzzlePrefetcher(puzzleSet)
+    session = prefetcher.next()
+    validMoves = session.gs.getValidMoves()
+    sqSelected = ()
+    playerClicks = []
+    solved = 0
+    mistakes = 0
+    endTime = pygame.time.get_ticks() + rushTime * 1000
+    finished = False
+    try:
+        while True:
+            for e in pygame.event.get():
+                if e.type == pygame.QUIT:
+                    return
+                elif e.type == pygame.MOUSEBUTTONDOWN:
+                    if finished:
+                        return
+                    sqSelected, playerClicks = puzzleClick(session, validMoves, sqSelected, playerClicks)
+                    validMoves = session.gs.getValidMoves()
+                elif e.type == pygame.KEYDOWN:
+                    if e.key == K_ESCAPE:
+                        pygame.quit()
+                        sys.exit()
+                    elif finished:
+                        return
+
+            if not finished and (session.solved or session.failed):
+                if session.solved:
+                    solved += 1
+                else:
+                    mistakes += 1
+                session = prefetcher.next()
+                validMoves = session.gs.getValidMoves()
+                sqSelected = ()
+                playerClicks = []
+
+            timeLeft = max(0, endTime - pygame.time.get_ticks()) // 1000
+            if timeLeft == 0 or mistakes >= rushMistakes:
+                finished = True
+            if finished:
+                lines = ["Rush over, %d solved" % solved, "Click to go back"]
+            else:
+                lines = ["%s to mate in %d" % ('White' if session.gs.whiteToMove else 'Black', session.puzzle.mateIn),
+                         "Time %d:%02d  Solved %d  Mistakes %d/%d" % (timeLeft // 60, timeLeft % 60, solved, mistakes,
+                                                                    rushMistakes)]
+            drawPuzzle(screen, session, lines)
+            clock.tick(maxfps)
+            pygame.display.flip()
+    finally:
+        prefetcher.stop()
+
 
 def drawGameState(screen, gs):
     drawBoard(screen)
@@ -0,0 +1,283 @@
+import ChessEngine
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Game server, many games are played at once over plain TCP on localhost. Every message is one line of JSON in each
+# direction, e.g.
+#   {"cmd": "new"}                                  -> {"ok": true, "session": 1, ...}
+#   {"cmd": "move", "session": 1, "move": "e2e4"}   -> {"ok": true, "move": "e2e4", ...}
+#   {"cmd": "ai", "session": 1, "timeLimit": 1.0}   -> {"ok": true, "move": "e7e5", "score": "-0.05", ...}
+#   {"cmd": "state", "session": 1}                  -> {"ok": true, "board": [...], ...}
+#   {"cmd": "close", "session": 1}                  -> {"ok": true}
+# Each session has its own GameState, the searches for AI moves are shared out between a pool of worker processes.
+# Requests on a connection are handled at the same time (only requests for the same game wait for each other) so a
+# front end can play many games over one connection. Replies come back in the order they finish, a request with an
+# "id" gets it back in its reply to match them up.
+
+host = '127.0.0.1'
+port = 8765
+# limits on how long the client can ask the AI to think for, in seconds
+defaultTimeLimit = 1.0
+maxTimeLimit = 10.0
+# deepest the AI will search however much time it has
+maxSearchDepth = 6
+
+
+class ServerBusy(Exception):
+    # raised when the engine queue is full, the client is told to try again later
+    pass
+
+
+def searchWorker(position, history, deadline):
+    # runs in a worker process, the position is sent packed by GameState.toBytes along with the hash keys of the
+    # positions since the last pawn move or capture so the search can see repetitions, returns the move and its score.
+    # deadline is the time.time() the answer is due by, fixed when the search was queued so time spent waiting for a
+    # worker comes out of the search's time (with none left only the untimed depth 0 search is done)
+    gs = ChessEngine.GameState().fromBytes(position, history)
+    move = gs.getTimedBestMove(max(0.0, deadline - time.time()), maxSearchDepth)
+    return move.getChessNot(), ChessEngine.describeScore(gs.searchScore)
+
+
+class EnginePool():
+    # Shares the worker processes between connections. Each connection has its own queue of searches and the
+    # dispatcher takes one search from each connection in turn, so a client asking for lots of searches (say for
+    # hundreds of games) can't starve the others.
+    # At most maxQueued searches can be waiting, after that new ones are turned away with ServerBusy.
+    def __init__(self, workers, maxQueued):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.freeWorkers = asyncio.Semaphore(workers)
+        self.maxQueued = maxQueued
+        self.queued = 0
+        self.queues = collections.OrderedDict()
+        self.jobWaiting = asyncio.Event()
+        self.dispatcherTask = None
+
+    def start(self):
+        self.dispatcherTask = asyncio.create_task(self.dispatcher())
+
+    async def stop(self):
+        if self.dispatcherTask is not None:
+            self.dispatcherTask.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def search(self, clientId, position, history, timeLimit):
+        if self.queued >= self.maxQueued:
+            raise ServerBusy()
+        result = asyncio.get_running_loop().create_future()
+        # the time limit is kept to by the search itself in the worker, counted from now rather than from when a
+        # worker is free
+        deadline = time.time() + timeLimit
+        self.queues.setdefault(clientId, collections.deque()).append((position, history, deadline, result))
+        self.queued += 1
+        self.jobWaiting.set()
+        return await result
+
+    def nextJob(self):
+        # round robin, the first connection in the queue gives up one search and goes to the back
+        clientId, queue = next(iter(self.queues.items()))
+        job = queue.popleft()
+        if queue:
+            self.queues.move_to_end(clientId)
+        else:
+            del self.queues[clientId]
+        self.queued -= 1
+        return job
+
+    async def dispatcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.queues:
+                self.jobWaiting.clear()
+                await self.jobWaiting.wait()
+                continue
+            await self.freeWorkers.acquire()
+            position, history, deadline, result = self.nextJob()
+            # the client may have given up waiting while the search was queued
+            if result.done():
+                self.freeWorkers.release()
+                continue
+            executor = self.executor
+            try:
+                future = loop.run_in_executor(executor, searchWorker, position, history, deadline)
+            except BrokenProcessPool as e:
+                self.replaceExecutor(executor)
+                self.freeWorkers.release()
+                if not result.done():
+                    result.set_exception(e)
+                continue
+            future.add_done_callback(lambda done, result=result, executor=executor:
+                                     self.finished(done, result, executor))
+
+    def replaceExecutor(self, broken):
+        # a worker process that dies breaks the whole pool, every search on it fails and nothing more can be
+        # submitted, so it is swapped for a new one (once, however many searches find it broken)
+        if self.executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def finished(self, done, result, executor):
+        self.freeWorkers.release()
+        if not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+            self.replaceExecutor(executor)
+        if result.done():
+            return
+        if done.cancelled():
+            result.cancel()
+        elif done.exception() is not None:
+            result.set_exception(done.exception())
+        else:
+            result.set_result(done.result())
+
+
+class GameSession():
+    def __init__(self, sessionId):
+        self.sessionId = sessionId
+        self.gs = ChessEngine.GameState()
+        self.validMoves = self.gs.getValidMoves()
+        # one request at a time per game so an AI move can't cross with a player move
+        self.lock = asyncio.Lock()
+
+    def playMove(self, notation):
+        for move in self.validMoves:
+            if move.getChessNot() == notation:
+                self.gs.makeMove(move)
+                self.validMoves = self.gs.getValidMoves()
+                return True
+        return False
+
+    def drawReason(self):
+        return None if self.gs.checkMate else self.gs.getDrawReason()
+
+    def gameOver(self):
+        return len(self.validMoves) == 0 or self.drawReason() is not None
+
+    def searchHistory(self):
+        # hash keys of the positions that could still be repeated, for searchWorker
+        log = self.gs.hashKeyLog
+        return log[max(0, len(log) - 1 - self.gs.getHalfmoveClock()):-1]
+
+    def status(self):
+        return {'session': self.sessionId, 'whiteToMove': self.gs.whiteToMove,
+                'checkMate': self.gs.checkMate, 'stalemate': self.gs.stalemate, 'draw': self.drawReason(),
+                'moves': [move.getChessNot() for move in self.gs.moveLog]}
+
+
+class ChessServer():
+    def __init__(self, workers, maxQueued):
+        self.pool = EnginePool(workers, maxQueued)
+        self.sessions = {}
+        self.sessionIds = itertools.count(1)
+        self.clientIds = itertools.count(1)
+
+    async def handleClient(self, reader, writer):
+        # sessions belong to the connection that made them and go when it closes, each request is a task of its own
+        owned = set()
+        clientId = next(self.clientIds)
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self.reply(line, owned, clientId, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            # nobody is left to answer, any searches still queued are dropped by the dispatcher
+            for task in tasks:
+                task.cancel()
+            for sessionId in owned:
+                self.sessions.pop(sessionId, None)
+            writer.close()
+
+    async def reply(self, line, owned, clientId, writer):
+        request = None
+        try:
+            request = json.loads(line)
+            reply = await self.handleRequest(request, owned, clientId)
+        except (ValueError, KeyError, TypeError) as e:
+            reply = {'ok': False, 'error': 'bad request: ' + str(e)}
+        if isinstance(request, dict) and 'id' in request:
+            reply['id'] = request['id']
+        writer.write((json.dumps(reply) + '\n').encode())
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def handleRequest(self, request, owned, clientId):
+        cmd = request['cmd']
+        if cmd == 'new':
+            sessionId = next(self.sessionIds)
+            self.sessions[sessionId] = GameSession(sessionId)
+            owned.add(sessionId)
+            return dict(ok=True, **self.sessions[sessionId].status())
+
+        sessionId = request['session']
+        if sessionId not in owned:
+            return {'ok': False, 'error': 'unknown session'}
+        session = self.sessions[sessionId]
+        if cmd == 'close':
+            owned.discard(sessionId)
+            del self.sessions[sessionId]
+            return {'ok': True}
+
+        async with session.lock:
+            if cmd == 'state':
+                return dict(ok=True, board=session.gs.board, **session.status())
+            if cmd == 'move':
+                if session.gameOver():
+                    return {'ok': False, 'error': 'game over'}
+                if not session.playMove(request['move']):
+                    return {'ok': False, 'error': 'illegal move'}
+                return dict(ok=True, move=request['move'], **session.status())
+            if cmd == 'ai':
+                if session.gameOver():
+                    return {'ok': False, 'error': 'game over'}
+                timeLimit = float(request.get('timeLimit', defaultTimeLimit))
+                # nan would never reach the search's deadline
+                if not math.isfinite(timeLimit):
+                    raise ValueError("timeLimit must be a number of seconds")
+                timeLimit = min(max(timeLimit, 0.0), maxTimeLimit)
+                try:
+                    notation, score = await self.pool.search(clientId, session.gs.toBytes(), session.searchHistory(),
+                                                           timeLimit)
+                except ServerBusy:
+                    return {'ok': False, 'error': 'busy'}
+                except Exception:
+                    # the worker crashed or the search raised, the game is left as it was
+                    return {'ok': False, 'error': 'engine error'}
+                session.playMove(notation)
+                return dict(ok=True, move=notation, score=score, **session.status())
+        return {'ok': False, 'error': 'unknown command'}
+
+    async def serve(self, host, port):
+        self.pool.start()
+        server = await asyncio.start_server(self.handleClient, host, port)
+        print("Serving on", host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.pool.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chess game server")
+    parser.add_argument('--host', default=host)
+    parser.add_argument('--port', type=int, default=port)
+    parser.add_argument('--workers', type=int, default=None, help="engine processes (default: one per core)")
+    parser.add_argument('--max-queued', type=int, default=256, help="searches allowed to wait for a worker")
+    args = parser.parse_args()
+    asyncio.run(ChessServer(args.workers or os.cpu_count() or 1, args.max_queued).serve(args.host, args.port))
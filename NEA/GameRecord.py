@@ -0,0 +1,175 @@
+import ChessEngine
+import argparse
+import array
+import gc
+import random
+import struct
+import sys
+import time
+import tracemalloc
+
+# Compact record of a game for replay and analysis tools. Each move is 16 bits (start square * 64 + end square,
+# squares numbered row * 8 + col, enpassant, castling and promotion are worked out from the board by moveFromID) and
+# every snapshotInterval plies the position is kept packed by GameState.toBytes. Seeking to a ply starts from the
+# snapshot at or before it and replays fewer than snapshotInterval moves, however long the game is.
+#
+#   record = GameRecord.fromMoves(gs.moveLog)
+#   gs = record.seek(40)
+#
+# A seeked GameState only has the replayed moves in its moveLog, so it can't be undone back past the snapshot (use
+# seek again to go backwards).
+
+snapshotInterval = 16
+# plies and number of snapshots, at the start of a record packed by toBytes
+recordHeader = struct.Struct('>HH')
+# length of each record in an archive file
+archiveLength = struct.Struct('>I')
+
+
+def encodeMove(move):
+    return (move.startRow * 8 + move.startCol) << 6 | (move.endRow * 8 + move.endCol)
+
+
+def decodeMove(code):
+    # the moveID of an encoded move
+    startRow, startCol = divmod(code >> 6, 8)
+    endRow, endCol = divmod(code & 63, 8)
+    return startRow * 1000 + startCol * 100 + endRow * 10 + endCol
+
+
+class GameRecord():
+    def __init__(self, start=None):
+        # start is the position the game starts from packed by toBytes, the normal start position by default
+        self.moves = array.array('H')
+        self.snapshots = [start if start is not None else ChessEngine.GameState().toBytes()]
+
+    def push(self, move, gs):
+        # adds a move, gs is the game after the move has been made on it
+        self.moves.append(encodeMove(move))
+        if len(self.moves) % snapshotInterval == 0:
+            self.snapshots.append(gs.toBytes())
+
+    def plies(self):
+        return len(self.moves)
+
+    def seek(self, ply, gs=None):
+        # the position after ply moves, in gs if one is given (reusing a GameState saves setting up a new one each
+        # time when scrubbing through a game)
+        if not 0 <= ply <= len(self.moves):
+            raise IndexError("ply %d is outside the game (0 to %d)" % (ply, len(self.moves)))
+        if gs is None:
+            gs = ChessEngine.GameState()
+        snapshot = ply // snapshotInterval
+        gs.fromBytes(self.snapshots[snapshot])
+        for code in self.moves[snapshot * snapshotInterval:ply]:
+            gs.makeMove(gs.moveFromID(decodeMove(code)))
+        return gs
+
+    def moveAt(self, ply):
+        # the move played from the position at ply, as a Move in that position
+        return self.seek(ply).moveFromID(decodeMove(self.moves[ply]))
+
+    def toBytes(self):
+        moves = array.array('H', self.moves)
+        if sys.byteorder == 'little':
+            moves.byteswap()
+        return recordHeader.pack(len(self.moves), len(self.snapshots)) + b''.join(self.snapshots) + moves.tobytes()
+
+    @staticmethod
+    def fromBytes(data):
+        record = GameRecord.__new__(GameRecord)
+        plies, snapshots = recordHeader.unpack_from(data)
+        offset = recordHeader.size
+        size = ChessEngine.positionSize
+        record.snapshots = [bytes(data[offset + i * size:offset + (i + 1) * size]) for i in range(snapshots)]
+        offset += snapshots * size
+        record.moves = array.array('H')
+        record.moves.frombytes(data[offset:offset + plies * 2])
+        if sys.byteorder == 'little':
+            record.moves.byteswap()
+        return record
+
+    def size(self):
+        # bytes used by the moves and snapshots themselves
+        return len(self.moves) * self.moves.itemsize + sum(len(snapshot) for snapshot in self.snapshots)
+
+    @staticmethod
+    def fromMoves(moves, start=None):
+        # builds a record by replaying moves (e.g. a GameState's moveLog) from start
+        record = GameRecord(start)
+        gs = ChessEngine.GameState()
+        if start is not None:
+            gs.fromBytes(start)
+        for move in moves:
+            move = gs.moveFromID(move.moveID)
+            gs.makeMove(move)
+            record.push(move, gs)
+        return record
+
+
+def saveArchive(path, records):
+    with open(path, 'wb') as f:
+        for record in records:
+            data = record.toBytes()
+            f.write(archiveLength.pack(len(data)))
+            f.write(data)
+
+
+def loadArchive(path):
+    # reads every record in an archive file, nothing is replayed until a record is seeked
+    records = []
+    with open(path, 'rb') as f:
+        data = memoryview(f.read())
+    offset = 0
+    while offset < len(data):
+        length, = archiveLength.unpack_from(data, offset)
+        offset += archiveLength.size
+        records.append(GameRecord.fromBytes(data[offset:offset + length]))
+        offset += length
+    return records
+
+
+def randomGame(plies, seed):
+    # a GameState with a random game of up to plies moves played on it
+    rng = random.Random(seed)
+    gs = ChessEngine.GameState()
+    for i in range(plies):
+        moves = gs.getValidMoves()
+        if not moves:
+            break
+        gs.makeMove(rng.choice(moves))
+    return gs
+
+
+def tracedSize(build):
+    # memory allocated by build() that is still in use afterwards, and what build returned
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    # a GameState refers to itself through moveFunctions so one that was thrown away is only freed by the collector
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, result
+
+
+if __name__ == "__main__":
+    # compares a record with the GameState logs for a random game and times seeking to every ply
+    parser = argparse.ArgumentParser(description="Game record memory use and seek speed")
+    parser.add_argument('--plies', type=int, default=400)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    gsSize, gs = tracedSize(lambda: randomGame(args.plies, args.seed))
+    recordSize, record = tracedSize(lambda: GameRecord.fromMoves(gs.moveLog))
+    print("%d plies" % record.plies())
+    print("GameState with its logs %9d bytes" % gsSize)
+    print("GameRecord              %9d bytes (%d bytes of moves and snapshots)" % (recordSize, record.size()))
+    print("packed record           %9d bytes" % len(record.toBytes()))
+
+    target = ChessEngine.GameState()
+    start = time.perf_counter()
+    for ply in range(record.plies() + 1):
+        record.seek(ply, target)
+    elapsed = time.perf_counter() - start
+    print("seek to every ply: %.1f us per seek" % (elapsed / (record.plies() + 1) * 1e6))
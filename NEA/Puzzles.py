@@ -1,105 +1,258 @@
-import math
-import copy
-
-class GameStatePuzzles():
-    def __init__(self):
-        # board is 8x8 2D List, each element of the list has 2 characters
-        # First character == colour (b = black ,w = white)
-        # second character == piece
-        # R == rook, N == knight, B == bishop, Q == Queen, K == king, P == pawn
-        # -- == empty space
-        # start board
-        self.board = [
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "wR"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["bK", "--", "wK", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"]]
-
-        self.whiteToMove = True
-        self.moveLog = []
-
-        # These are defined and set to false as either can be changed to the bool True in order to end the game
-        self.checkMate = False
-        self.stalemate = False
-
-    # Function defined for making the move, self represents the instance of the class. By using the “self” keyword we
-    # can access the attributes and methods of the class in python. It binds the attributes with the given arguments.
-    def makeMove(self, move):
-        # Makes the square from which the piece is moving clear
-        self.board[move.startRow][move.startCol] = '--'
-        # Moves the piece from Starting Square to Finishing Square
-        self.board[move.endRow][move.endCol] = move.pieceMoved
-        # Adds the move to the move log
-        self.moveLog.append(move)
-        # Changes which side it is to move
-        self.whiteToMove = not self.whiteToMove
-        # Checks whether either king has been moved
-        if move.pieceMoved == 'wK':
-            self.wKingLoc = (move.endRow, move.endCol)
-        elif move.pieceMoved == 'bK':
-            self.bKingLoc = (move.endRow, move.endCol)
-
-        # Promotion
-        if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
-
-        # Making it so you can perform enpassant, remember Rank 2 = Rank 1 in python indexing from 0
-        if move.isEnpassantMove:
-            self.board[move.startRow][move.endCol] = '--'
-        if move.pieceMoved[1] == 'P' and abs(move.startRow - move.endRow) == 2:
-            self.enpassantPossible = ((move.startRow + move.endRow) // 2, move.startCol)
-        else:
-            self.enpassantPossible = ()
-
-    def printBoard(self):
-        for x in range(8):
-            print(self.board[x])
-
-    def printLog(self):
-        for x in self.moveLog:
-            print(x.moveID)
-
-class Move():
-    # able to allow chess notation to python array location
-    ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
-                   "5": 3, "6": 2, "7": 1, "8": 0}
-    rowsToRanks = {v: k for k, v in ranksToRows.items()}
-
-    filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3,
-                   "e": 4, "f": 5, "g": 6, "h": 7}
-    colsToFiles = {v: k for k, v in filesToCols.items()}
-
-    def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False):
-        # start location/square
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        # end location/square
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        # piece moved/captured
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        # bool to see if either black or white pawn has been moved to the end row
-        self.isPawnPromotion = (
-                (self.pieceMoved == 'wP' and self.endRow == 0) or (self.pieceMoved == 'bP' and self.endRow == 7))
-
-        self.isEnpassantMove = isEnpassantMove
-
-        if self.isEnpassantMove:
-            self.pieceCaptured = 'wP' if self.pieceMoved == 'bP' else 'bP'
-
-        self.isCastleMove = isCastleMove
-
-        # to compare the moves
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
-
-    # with use of the fileToRank dictionaries we can print out the move in chess notation (e2e4)
-    def getChessNot(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
-
-    def getRankFile(self, r, c):
-        return self.colsToFiles[c] + self.rowsToRanks[r]
\ No newline at end of file
+import ChessEngine
+import json
+import os
+import queue
+import random
+import threading
+
+# Mate puzzles played on the real engine. Each puzzle is a position (as FEN) and the number of moves the side to
+# move has to mate in. Its solution tree is worked out once and cached, both in memory and in a JSON file next to
+# this one, so the game only has to look moves up in it.
+#
+# A solution tree is a dict from each move (in chess notation) that still forces mate in the moves left to what
+# happens next: None if the move mates, otherwise [the defender's reply, the solution tree after that reply]. The
+# reply is the defence that holds out longest so the player has to find the whole mate.
+
+puzzleCachePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'puzzle_solutions.json')
+
+# (name, FEN, mate in)
+puzzleList = [
+    ("Rook mate", "8/7R/8/8/8/8/k1K5/8 w - - 0 1", 1),
+    ("Back rank", "6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1", 1),
+    ("Smothered mate", "6rk/6pp/8/6N1/8/8/8/7K w - - 0 1", 1),
+    ("Scholar's mate", "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4", 1),
+    ("Fool's mate", "rnbqkbnr/pppp1ppp/8/4p3/6P1/5P2/PPPPP2P/RNBQKBNR b KQkq - 0 2", 1),
+    ("Arabian mate", "7k/R7/5N2/8/8/8/8/K7 w - - 0 1", 1),
+    ("Black back rank", "1r4k1/5ppp/8/8/8/8/5PPP/6K1 b - - 0 1", 1),
+    ("King and rook", "7k/8/5K2/8/8/8/8/6R1 w - - 0 1", 2),
+    ("Legal's mate", "r2qkb1r/pp2nppp/3p4/2pNN1B1/2BnP3/3P4/PPP2PPP/R2bK2R w KQkq - 1 10", 2),
+    ("Opera game", "4kb1r/p2n1ppp/4q3/4p1B1/4P3/1Q6/PPP2PPP/2KR4 w k - 1 16", 2),
+]
+
+# solution trees keyed by the position (GameState.toBytes as hex) and the number of moves, loaded from
+# puzzleCachePath the first time one is needed
+solutionCache = None
+solutionCacheLock = threading.Lock()
+
+
+def positionFromFen(fen):
+    # returns a GameState set to the position, only the first four fields (board, side to move, castling and
+    # enpassant) and the move counters are used
+    fields = fen.split()
+    board = []
+    for rank in fields[0].split('/'):
+        row = []
+        for char in rank:
+            if char.isdigit():
+                row += ['--'] * int(char)
+            else:
+                row.append(('w' if char.isupper() else 'b') + char.upper())
+        board.append(row)
+    castling = tuple(right in fields[2] for right in 'KkQq')
+    enpassant = ()
+    if fields[3] != '-':
+        enpassant = (ChessEngine.Move.ranksToRows[fields[3][1]], ChessEngine.Move.filesToCols[fields[3][0]])
+    halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+    fullmove = int(fields[5]) if len(fields) > 5 else 1
+    return ChessEngine.GameState().setPosition(board, fields[1] == 'w', castling, enpassant, halfmoveClock, fullmove)
+
+
+def findMove(gs, notation):
+    # the valid move with the given chess notation, or None
+    for move in legalMoves(gs):
+        if move.getChessNot() == notation:
+            return move
+    return None
+
+
+def legalMoves(gs):
+    # getValidMoves without leaving checkMate or stalemate set
+    moves = gs.getValidMoves()
+    gs.checkMate = False
+    gs.stalemate = False
+    return moves
+
+
+def isCheckmate(gs):
+    # only worth generating the replies when the side to move is in check
+    return gs.inCheck() and len(legalMoves(gs)) == 0
+
+
+def solve(gs, movesLeft):
+    # the solution tree for the side to move mating within movesLeft moves, empty if there is no forced mate
+    tree = {}
+    for move in legalMoves(gs):
+        gs.makeMove(move)
+        if isCheckmate(gs):
+            tree[move.getChessNot()] = None
+        elif movesLeft > 1:
+            defence = stubbornestDefence(gs, movesLeft - 1)
+            if defence is not None:
+                tree[move.getChessNot()] = defence
+        gs.undoMove()
+    return tree
+
+
+def stubbornestDefence(gs, movesLeft):
+    # [reply, solution tree] for the reply that puts off the mate longest, or None if a reply escapes the mate or
+    # there are no replies (stalemate)
+    replies = legalMoves(gs)
+    if not replies:
+        return None
+    longest = None
+    for reply in replies:
+        gs.makeMove(reply)
+        # the quickest mate after this reply
+        tree = {}
+        for moves in range(1, movesLeft + 1):
+            tree = solve(gs, moves)
+            if tree:
+                break
+        gs.undoMove()
+        if not tree:
+            return None
+        if longest is None or moves > longest[0]:
+            longest = (moves, reply.getChessNot(), tree)
+    return [longest[1], longest[2]]
+
+
+def loadSolutionCache():
+    global solutionCache
+    if solutionCache is None:
+        solutionCache = {}
+        if os.path.exists(puzzleCachePath):
+            with open(puzzleCachePath) as f:
+                solutionCache = json.load(f)
+    return solutionCache
+
+
+def saveSolutionCache():
+    with solutionCacheLock:
+        with open(puzzleCachePath, 'w') as f:
+            json.dump(solutionCache, f)
+
+
+def getSolution(gs, mateIn, save=True):
+    # the solution tree for the position, from the cache if it has been solved before
+    key = gs.toBytes().hex() + ':' + str(mateIn)
+    with solutionCacheLock:
+        cache = loadSolutionCache()
+        if key in cache:
+            return cache[key]
+    tree = solve(gs, mateIn)
+    if not tree:
+        raise ValueError("no mate in %d" % mateIn)
+    with solutionCacheLock:
+        cache[key] = tree
+    if save:
+        saveSolutionCache()
+    return tree
+
+
+class Puzzle():
+    def __init__(self, name, fen, mateIn):
+        self.name = name
+        self.fen = fen
+        self.mateIn = mateIn
+        self.solution = None
+
+    def prepare(self, save=True):
+        # works out (or loads) the solution tree, returns self so it can be chained. The search is done on a
+        # GameState of its own so the prefetcher and the game can both prepare the same puzzle
+        if self.solution is None:
+            self.solution = getSolution(positionFromFen(self.fen), self.mateIn, save)
+        return self
+
+
+def loadPuzzles():
+    return [Puzzle(name, fen, mateIn) for name, fen, mateIn in puzzleList]
+
+
+def precomputeSolutions():
+    # solves every puzzle that isn't in the cache yet and writes the cache once at the end
+    puzzles = [puzzle.prepare(save=False) for puzzle in loadPuzzles()]
+    saveSolutionCache()
+    return puzzles
+
+
+class PuzzleSession():
+    # One puzzle being played. The player's moves are checked against the solution tree and the defender's replies
+    # are played straight after.
+    def __init__(self, puzzle):
+        self.puzzle = puzzle.prepare()
+        self.gs = positionFromFen(puzzle.fen)
+        self.node = self.puzzle.solution
+        self.solved = False
+        self.failed = False
+
+    def playerToMove(self):
+        return not self.solved and not self.failed
+
+    def tryMove(self, move):
+        # returns the defender's reply (a Move) if there is one, sets solved or failed
+        notation = move.getChessNot()
+        if notation not in self.node:
+            self.failed = True
+            return None
+        self.gs.makeMove(move)
+        nextStep = self.node[notation]
+        if nextStep is None:
+            self.solved = True
+            return None
+        replyNotation, self.node = nextStep
+        reply = findMove(self.gs, replyNotation)
+        self.gs.makeMove(reply)
+        return reply
+
+
+class PuzzlePrefetcher():
+    # Background thread for puzzle rush that keeps the next few puzzles ready, shuffled and with their solution
+    # trees worked out, so moving on to the next puzzle never waits. If preparing a puzzle fails the error is passed
+    # on to whoever calls next.
+    def __init__(self, puzzles, ahead=3, seed=None):
+        self.puzzles = list(puzzles)
+        self.ready = queue.Queue(maxsize=ahead)
+        self.random = random.Random(seed)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                order = self.puzzles[:]
+                self.random.shuffle(order)
+                for puzzle in order:
+                    if not self.put(PuzzleSession(puzzle)):
+                        return
+        except Exception as e:
+            self.put(e)
+
+    def put(self, item):
+        # waits for room in the queue, returns False if the prefetcher is stopped first
+        while not self.stopped.is_set():
+            try:
+                self.ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def next(self):
+        item = self.ready.get()
+        if isinstance(item, Exception):
+            # left in the queue so every later call fails the same way rather than waiting forever
+            self.ready.put(item)
+            raise item
+        return item
+
+    def stop(self):
+        # waits for the thread to finish so nothing is still being solved once the rush is over
+        self.stopped.set()
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    # python Puzzles.py solves every puzzle into the cache file
+    for puzzle in precomputeSolutions():
+        print("%-16s mate in %d, first moves %s" % (puzzle.name, puzzle.mateIn, ', '.join(puzzle.solution)))
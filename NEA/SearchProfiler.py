@@ -0,0 +1,156 @@
+import ChessEngine
+import argparse
+import inspect
+import linecache
+import sys
+import tracemalloc
+
+# Memory profiling for getBestMove using tracemalloc. The search itself runs exactly as normal, the profiler only
+# watches: it records the peak, snapshots the heap whenever the search reaches a new high, and at the end reports
+# how much memory each node left behind and which parts of the engine the memory at the peak belongs to.
+#
+#   python SearchProfiler.py --depth 2 --position middlegame
+#   python SearchProfiler.py --max-retained-per-node 64        exit code 1 if the search leaks more than that
+
+# functions in ChessEngine whose allocations count towards each category
+categoryFunctions = {
+    'moves': {'Move.__init__', 'GameState.getAllMoves', 'GameState.getValidMoves', 'GameState.getPawnMoves',
+              'GameState.getSlidingMoves', 'GameState.getStepMoves', 'GameState.getCastleMoves',
+              'GameState.getKingsideCastleMoves', 'GameState.getQueensideCastleMoves', 'GameState.orderMoves'},
+    'castle rights': {'castleRights.__init__', 'GameState.updateCastleRights'},
+    'eval tables': {'GameState.staticEval', 'GameState.pawnStructureEval', 'GameState.getPawnStructureScore',
+                    'GameState.computePawnKey', 'GameState.boardEval'},
+    'search': {'GameState.minimax', 'GameState.quiescence', 'GameState.getBestMove', 'GameState.staticExchange'},
+}
+# a line that mentions one of these belongs to that category whatever function it is in (checked first)
+categoryWords = [('castle rights', ('castleRights', 'CastlingRight')), ('move log', ('moveLog',)),
+                 ('undo logs', ('enpassantPossibleLog', 'pawnKeyLog', 'checkers', 'hashKeyLog', 'halfmoveClockLog')),
+                 ('moves', ('Move(',)), ('eval tables', ('pawnHashTable',)), ('search', ('pvTable',))]
+
+
+def buildLineMap():
+    # (first line, last line, name) for every function in ChessEngine so a traced line can be put in a function
+    functions = []
+    for className, cls in inspect.getmembers(ChessEngine, inspect.isclass):
+        if cls.__module__ != ChessEngine.__name__:
+            continue
+        for name, function in inspect.getmembers(cls, inspect.isfunction):
+            lines, start = inspect.getsourcelines(function)
+            functions.append((start, start + len(lines) - 1, className + '.' + name))
+    return functions
+
+
+def categorise(traceback, engineFile, lineMap):
+    # goes from the innermost frame outwards and uses the first frame inside ChessEngine
+    for frame in reversed(traceback):
+        if frame.filename != engineFile:
+            continue
+        line = linecache.getline(frame.filename, frame.lineno)
+        for category, words in categoryWords:
+            if any(word in line for word in words):
+                return category
+        for start, end, name in lineMap:
+            if start <= frame.lineno <= end:
+                for category, names in categoryFunctions.items():
+                    if name in names:
+                        return category
+        return 'other engine'
+    return 'other'
+
+
+def profileSearch(gs, depth, frames=8, top=10):
+    # runs gs.getBestMove(depth) under tracemalloc, returns the move it chose and a report dict
+    engineFile = ChessEngine.__file__
+    lineMap = buildLineMap()
+    wasTracing = tracemalloc.is_tracing()
+    if not wasTracing:
+        tracemalloc.start(frames)
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    baseline = tracemalloc.get_traced_memory()[0]
+    highest = {'bytes': baseline, 'snapshot': before}
+    searchMinimax = gs.minimax
+
+    # minimax is wrapped for this GameState only, it checks the memory in use on every call and snapshots the heap
+    # each time it gets 5% higher than the last snapshot, so the last snapshot shows what the peak was made of
+    def watchedMinimax(depth, alpha, beta, isMaximiser):
+        current = tracemalloc.get_traced_memory()[0]
+        if current > highest['bytes'] * 1.05:
+            highest['bytes'] = current
+            highest['snapshot'] = tracemalloc.take_snapshot()
+        return searchMinimax(depth, alpha, beta, isMaximiser)
+
+    gs.nodes = 0
+    gs.minimax = watchedMinimax
+    try:
+        move = gs.getBestMove(depth)
+    finally:
+        del gs.minimax
+    peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    if not wasTracing:
+        tracemalloc.stop()
+
+    nodes = max(gs.nodes, 1)
+    retained = after.compare_to(before, 'traceback')
+    retainedBytes = sum(stat.size_diff for stat in retained)
+    retainedBlocks = sum(stat.count_diff for stat in retained)
+
+    # what the memory above the baseline was being used for at the highest snapshot
+    atPeak = highest['snapshot'].compare_to(before, 'traceback')
+    categories = {}
+    sites = {}
+    for stat in atPeak:
+        if stat.size_diff <= 0:
+            continue
+        category = categorise(stat.traceback, engineFile, lineMap)
+        categories[category] = categories.get(category, 0) + stat.size_diff
+        # sites are grouped by the line that made the allocation, whatever called it
+        frame = stat.traceback[-1]
+        site = (category, '%s:%d' % (frame.filename, frame.lineno))
+        size, count = sites.get(site, (0, 0))
+        sites[site] = (size + stat.size_diff, count + stat.count_diff)
+    sites = sorted(((size, count, category, site) for (category, site), (size, count) in sites.items()),
+                   reverse=True)
+
+    report = {'move': move.getChessNot() if move is not None else None,
+              'nodes': gs.nodes,
+              'peakBytes': peak - baseline,
+              'retainedBytes': retainedBytes,
+              'retainedBytesPerNode': retainedBytes / nodes,
+              'retainedBlocksPerNode': retainedBlocks / nodes,
+              'peakBlocksPerNode': sum(stat.count_diff for stat in atPeak if stat.count_diff > 0) / nodes,
+              'peakByCategory': dict(sorted(categories.items(), key=lambda item: -item[1])),
+              'topSites': sites[:top]}
+    return move, report
+
+
+def printReport(report):
+    print("move %s  nodes %d" % (report['move'], report['nodes']))
+    print("peak above start        %10d bytes" % report['peakBytes'])
+    print("retained after search   %10d bytes (%.1f bytes, %.3f blocks per node)" % (
+        report['retainedBytes'], report['retainedBytesPerNode'], report['retainedBlocksPerNode']))
+    print("live blocks at peak     %10.3f per node" % report['peakBlocksPerNode'])
+    print("\nat the peak, by category:")
+    for category, size in report['peakByCategory'].items():
+        print("  %-15s %10d bytes" % (category, size))
+    print("\ntop allocation sites at the peak:")
+    for size, count, category, site in report['topSites']:
+        print("  %10d bytes %7d blocks  %-15s %s" % (size, count, category, site))
+
+
+if __name__ == "__main__":
+    import Benchmark
+    parser = argparse.ArgumentParser(description="Memory profile of getBestMove")
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--position', default='middlegame', help="one of the Benchmark corpus positions")
+    parser.add_argument('--frames', type=int, default=8, help="stack frames kept for each allocation")
+    parser.add_argument('--max-retained-per-node', type=float, default=None,
+                        help="fail if the search keeps more than this many bytes per node")
+    args = parser.parse_args()
+    gs = Benchmark.corpus()[args.position]
+    move, report = profileSearch(gs, args.depth, args.frames)
+    printReport(report)
+    if args.max_retained_per_node is not None and report['retainedBytesPerNode'] > args.max_retained_per_node:
+        print("\nretained memory per node over the limit of", args.max_retained_per_node)
+        sys.exit(1)
@@ -0,0 +1,266 @@
+import ChessEngine
+import argparse
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# Headless engine against engine matches for checking whether a change makes the engine stronger. Engine A and
+# engine B each have their own search settings, every opening is played twice with the colours swapped and the games
+# are spread over a pool of processes. The match stops early once the SPRT decides between elo0 and elo1.
+#
+# The engines search the same way every time they see a position, so the same opening would give the same game
+# and count as many samples of one result. Each pair of games plays a few random moves on the end of its opening and
+# a pair isn't given a position another pair already starts from (the seed makes a match repeatable).
+#
+#   python SelfPlay.py --games 2000 --a-depth 2 --b-depth 1
+#   python SelfPlay.py --a-time 10+0.1 --b-time 10+0.1 --elo0 0 --elo1 10
+
+# short openings in chess notation, played from the start position before the engines take over
+openings = [
+    [],
+    ['e2e4', 'e7e5'], ['e2e4', 'c7c5'], ['e2e4', 'e7e6'], ['e2e4', 'c7c6'], ['e2e4', 'd7d5'],
+    ['d2d4', 'd7d5'], ['d2d4', 'g8f6'], ['d2d4', 'f7f5'], ['c2c4', 'e7e5'], ['c2c4', 'c7c5'],
+    ['g1f3', 'd7d5'], ['g1f3', 'g8f6'], ['e2e4', 'e7e5', 'g1f3', 'b8c6'], ['e2e4', 'c7c5', 'g1f3', 'd7d6'],
+    ['d2d4', 'd7d5', 'c2c4', 'e7e6'], ['d2d4', 'g8f6', 'c2c4', 'g7g6'], ['e2e4', 'e7e5', 'f1c4', 'g8f6'],
+    ['d2d4', 'd7d5', 'c2c4', 'c7c6'], ['e2e4', 'g7g6'], ['b2b3', 'e7e5'], ['g2g3', 'd7d5'],
+]
+# random plies played after each opening
+randomPlies = 4
+# games still going after this many plies are scored as draws
+maxPlies = 200
+
+
+class EngineSettings():
+    # depth is passed to getBestMove. With a time control of base + increment seconds the engine instead searches
+    # iteratively (up to depth + 4) on a budget of its remaining time / 30 plus the increment each move.
+    def __init__(self, depth=2, base=None, increment=0.0):
+        self.depth = depth
+        self.base = base
+        self.increment = increment
+
+    def describe(self):
+        if self.base is None:
+            return "depth %d" % self.depth
+        return "%g+%g" % (self.base, self.increment)
+
+
+def parseSettings(depth, timeControl):
+    if timeControl is None:
+        return EngineSettings(depth)
+    base, increment = (timeControl.split('+') + ['0'])[:2]
+    return EngineSettings(depth, float(base), float(increment))
+
+
+def playOpening(gs, opening):
+    for notation in opening:
+        for move in gs.getValidMoves():
+            if move.getChessNot() == notation:
+                gs.makeMove(move)
+                break
+        else:
+            raise ValueError("illegal opening move " + notation)
+
+
+def randomOpening(opening, rng):
+    # the opening with randomPlies random moves after it, as a list of chess notation, and the position it reaches
+    # packed by toBytes
+    gs = ChessEngine.GameState()
+    playOpening(gs, opening)
+    line = list(opening)
+    for i in range(randomPlies):
+        moves = gs.getValidMoves()
+        if len(moves) == 0:
+            break
+        move = rng.choice(moves)
+        gs.makeMove(move)
+        line.append(move.getChessNot())
+    return line, gs.toBytes()
+
+
+def matchOpenings(pairs, seed):
+    # one opening per pair of games, going round the openings list with a different random tail every time
+    rng = random.Random(seed)
+    lines = []
+    seen = set()
+    for i in range(pairs):
+        opening = openings[i % len(openings)]
+        # a repeated position (the same line or a transposition) is tried again a few times
+        for attempt in range(20):
+            line, position = randomOpening(opening, rng)
+            if position not in seen:
+                break
+        seen.add(position)
+        lines.append(line)
+    return lines
+
+
+def playGame(opening, whiteSettings, blackSettings):
+    # plays one game, returns the result for white (1, 0.5 or 0) and a (white?, seconds, nodes) entry per engine move
+    gs = ChessEngine.GameState()
+    playOpening(gs, opening)
+    clocks = {True: whiteSettings.base, False: blackSettings.base}
+    moveStats = []
+    while True:
+        validMoves = gs.getValidMoves()
+        if len(validMoves) == 0:
+            if gs.checkMate:
+                return (0 if gs.whiteToMove else 1), moveStats
+            return 0.5, moveStats
+        if gs.getDrawReason() is not None or len(gs.moveLog) >= maxPlies:
+            return 0.5, moveStats
+        settings = whiteSettings if gs.whiteToMove else blackSettings
+        side = gs.whiteToMove
+        gs.nodes = 0
+        start = time.perf_counter()
+        if settings.base is None:
+            move = gs.getBestMove(settings.depth)
+        else:
+            budget = max(clocks[side], 0) / 30 + settings.increment
+            move = gs.getTimedBestMove(budget, settings.depth + 4)
+        elapsed = time.perf_counter() - start
+        moveStats.append((side, elapsed, gs.nodes))
+        if settings.base is not None:
+            clocks[side] += settings.increment - elapsed
+            # losing on time
+            if clocks[side] < 0:
+                return (0 if side else 1), moveStats
+        gs.makeMove(move)
+
+
+def playPair(opening, engineA, engineB, aWhite):
+    # runs in a worker, returns the score for engine A and the move stats split into A's and B's moves
+    if aWhite:
+        result, moveStats = playGame(opening, engineA, engineB)
+    else:
+        result, moveStats = playGame(opening, engineB, engineA)
+    scoreA = result if aWhite else 1 - result
+    statsA = [(seconds, nodes) for white, seconds, nodes in moveStats if white == aWhite]
+    statsB = [(seconds, nodes) for white, seconds, nodes in moveStats if white != aWhite]
+    return scoreA, statsA, statsB
+
+
+def eloFromScore(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def scoreFromElo(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+class MatchStats():
+    def __init__(self, elo0, elo1, alpha, beta):
+        self.wins = self.draws = self.losses = 0
+        self.elo0 = elo0
+        self.elo1 = elo1
+        # the SPRT stops when the log likelihood ratio leaves these bounds
+        self.lowerBound = math.log(beta / (1 - alpha))
+        self.upperBound = math.log((1 - beta) / alpha)
+        self.movesA = []
+        self.movesB = []
+
+    def add(self, scoreA, statsA, statsB):
+        if scoreA == 1:
+            self.wins += 1
+        elif scoreA == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+        self.movesA += statsA
+        self.movesB += statsB
+
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def scoreAndVariance(self):
+        n = self.games()
+        score = (self.wins + 0.5 * self.draws) / n
+        variance = (self.wins * (1 - score) ** 2 + self.draws * (0.5 - score) ** 2 + self.losses * score ** 2) / n
+        return score, variance
+
+    def elo(self):
+        # Elo difference of A over B with a 95% confidence margin
+        score, variance = self.scoreAndVariance()
+        margin = 1.96 * math.sqrt(variance / self.games())
+        return eloFromScore(score), eloFromScore(score + margin) - eloFromScore(score)
+
+    def llr(self):
+        # normal approximation to the trinomial log likelihood ratio of elo1 against elo0
+        score, variance = self.scoreAndVariance()
+        if variance == 0:
+            return 0.0
+        s0 = scoreFromElo(self.elo0)
+        s1 = scoreFromElo(self.elo1)
+        return self.games() * (s1 - s0) * (2 * score - s0 - s1) / (2 * variance)
+
+    def decision(self):
+        llr = self.llr()
+        if llr >= self.upperBound:
+            return 'H1'
+        if llr <= self.lowerBound:
+            return 'H0'
+        return None
+
+
+def percentiles(values, points=(50, 90, 99)):
+    values = sorted(values)
+    if not values:
+        return {p: 0.0 for p in points}
+    return {p: values[min(len(values) - 1, int(len(values) * p / 100))] for p in points}
+
+
+def speedReport(name, moves):
+    seconds = sum(s for s, n in moves)
+    nodes = sum(n for s, n in moves)
+    times = percentiles([s * 1000 for s, n in moves])
+    return "%s: %d moves, %.0f nps, ms per move p50 %.1f p90 %.1f p99 %.1f" % (
+        name, len(moves), nodes / seconds if seconds else 0, times[50], times[90], times[99])
+
+
+def runMatch(engineA, engineB, games, workers=None, elo0=0.0, elo1=5.0, alpha=0.05, beta=0.05, seed=1, log=print):
+    stats = MatchStats(elo0, elo1, alpha, beta)
+    # every opening with A as white then as black
+    lines = matchOpenings((games + 1) // 2, seed)
+    pairings = [(lines[i // 2], i % 2 == 0) for i in range(games)]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        pending = {pool.submit(playPair, opening, engineA, engineB, aWhite) for opening, aWhite in pairings}
+        decision = None
+        while pending and decision is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stats.add(*future.result())
+            decision = stats.decision()
+            elo, margin = stats.elo()
+            log("games %d  +%d =%d -%d  elo %.1f +/- %.1f  llr %.2f (%.2f, %.2f)" % (
+                stats.games(), stats.wins, stats.draws, stats.losses, elo, margin, stats.llr(),
+                stats.lowerBound, stats.upperBound))
+        for future in pending:
+            future.cancel()
+    return stats, decision
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Engine against engine match with SPRT")
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--a-depth', type=int, default=2)
+    parser.add_argument('--b-depth', type=int, default=2)
+    parser.add_argument('--a-time', default=None, help="time control as base+increment seconds, e.g. 10+0.1")
+    parser.add_argument('--b-time', default=None)
+    parser.add_argument('--elo0', type=float, default=0.0)
+    parser.add_argument('--elo1', type=float, default=5.0)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=1, help="seed for the random moves after each opening")
+    args = parser.parse_args()
+    engineA = parseSettings(args.a_depth, args.a_time)
+    engineB = parseSettings(args.b_depth, args.b_time)
+    print("A:", engineA.describe(), " B:", engineB.describe())
+    stats, decision = runMatch(engineA, engineB, args.games, args.workers, args.elo0, args.elo1, args.alpha,
+                               args.beta, args.seed)
+    print("SPRT:", {'H1': "A is stronger (elo1 accepted)", 'H0': "A is not stronger (elo0 accepted)",
+                    None: "no decision"}[decision])
+    print(speedReport("A", stats.movesA))
+    print(speedReport("B", stats.movesB))
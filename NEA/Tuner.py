@@ -0,0 +1,194 @@
+import ChessEngine
+import BatchEval
+import argparse
+import json
+import multiprocessing
+import numpy as np
+import os
+
+# Texel style tuning of the material values and piece square tables. The evaluation is linear in them: every white
+# piece adds its material value and its table entry for its square, every black piece takes away the same for the
+# mirrored square. So each position turns into 64 (parameter index, sign) pairs and the evaluation is a gather and a
+# sum. The predicted result is a sigmoid of the evaluation and the squared error against the real results is
+# minimised by gradient descent, with the positions split between worker processes.
+#
+# The dataset is either an .npz file with "positions" (a buffer from ChessEngine.encodePositions as uint8) and
+# "results" (1 white won, 0.5 draw, 0 black won), or a text file with one "<toBytes() in hex> <result>" per line.
+#
+#   python Tuner.py positions.npz --epochs 300
+#
+# writes evalTables.json next to ChessEngine.py which the engine loads when it starts.
+
+pieceTypes = ['P', 'N', 'B', 'R', 'Q', 'K']
+# parameters are the 64 table entries of each piece type then the material value of each piece type
+tableSize = 64 * len(pieceTypes)
+numParams = tableSize + len(pieceTypes)
+# smallest sigmoid scale fitK will use
+minK = 0.01
+
+
+def buildFeatureTables():
+    # for each piece code and square, the table entry it uses and whether it counts for (+1) or against (-1) white
+    tableIndex = np.zeros((16, 64), dtype=np.int16)
+    materialIndex = np.zeros(16, dtype=np.int16)
+    sign = np.zeros(16, dtype=np.int8)
+    for piece, code in ChessEngine.pieceCodes.items():
+        if piece == '--':
+            continue
+        t = pieceTypes.index(piece[1])
+        for square in range(64):
+            r, c = divmod(square, 8)
+            # black pieces use the white table flipped top to bottom
+            tableIndex[code, square] = t * 64 + (square if piece[0] == 'w' else (7 - r) * 8 + c)
+        materialIndex[code] = tableSize + t
+        sign[code] = 1 if piece[0] == 'w' else -1
+    return tableIndex, materialIndex, sign
+
+
+tableIndex, materialIndex, featureSign = buildFeatureTables()
+
+
+def currentParams():
+    params = np.zeros(numParams)
+    for t, pieceType in enumerate(pieceTypes):
+        params[t * 64:(t + 1) * 64] = np.array(ChessEngine.pieceSquareTables['w' + pieceType]).ravel()
+        params[tableSize + t] = ChessEngine.materialValues['w' + pieceType]
+    return params
+
+
+def loadDataset(path):
+    # returns (codes, results), codes being the (N, 64) piece code array BatchEval uses
+    if path.endswith('.npz'):
+        data = np.load(path)
+        return BatchEval.bytesToArray(data['positions'].tobytes()), data['results'].astype(np.float64)
+    buffer = bytearray()
+    results = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                position, result = line.split()
+                buffer += bytes.fromhex(position)
+                results.append(float(result))
+    return BatchEval.bytesToArray(bytes(buffer)), np.array(results)
+
+
+class Chunk():
+    # one worker's share of the positions, turned into parameter indices and signs once at the start
+    def __init__(self, codes, results):
+        codes = codes.astype(np.intp)
+        self.indices = tableIndex[codes, np.arange(64)]
+        self.materialIndices = materialIndex[codes]
+        self.signs = featureSign[codes].astype(np.float64)
+        # the pawn structure terms aren't tuned, they are a fixed amount added to each evaluation
+        self.offset = BatchEval.pawnStructureBatch(codes).astype(np.float64)
+        self.results = results
+
+    def evaluate(self, params):
+        return (self.signs * (params[self.indices] + params[self.materialIndices])).sum(axis=1) + self.offset
+
+    def lossAndGradient(self, params, k):
+        # sum of squared errors and its gradient for this chunk
+        predicted = sigmoid(self.evaluate(params), k)
+        error = predicted - self.results
+        # d(error^2)/d(eval) for each position, spread back over the parameters its pieces used
+        perPosition = 2 * error * predicted * (1 - predicted) * k * np.log(10) / 400
+        weights = (self.signs * perPosition[:, None]).ravel()
+        gradient = np.bincount(self.indices.ravel(), weights=weights, minlength=numParams)
+        gradient += np.bincount(self.materialIndices.ravel(), weights=weights, minlength=numParams)
+        return (error ** 2).sum(), gradient
+
+
+def sigmoid(evaluation, k):
+    # expected result for white from the evaluation in centipawns
+    return 1 / (1 + 10 ** (-k * evaluation / 400))
+
+
+# the chunks live in the worker processes so only the parameters are sent each step
+workerChunk = None
+
+
+def initWorker(codes, results):
+    global workerChunk
+    workerChunk = Chunk(codes, results)
+
+
+def workerStep(args):
+    params, k = args
+    return workerChunk.lossAndGradient(params, k)
+
+
+def fitK(chunk, params):
+    # the scaling constant that best fits the current evaluation to the results, found by a coarse then fine scan.
+    # K has to stay above 0, at 0 the sigmoid is flat and every gradient is zero so nothing would be tuned
+    best = 1.0
+    for candidates in (np.linspace(0.1, 3, 30), None):
+        if candidates is None:
+            candidates = np.linspace(max(best - 0.1, minK), best + 0.1, 21)
+        losses = [((sigmoid(chunk.evaluate(params), k) - chunk.results) ** 2).mean() for k in candidates]
+        best = candidates[int(np.argmin(losses))]
+    if best <= minK:
+        raise ValueError("the evaluation doesn't fit the results (best K is the lowest tried, %g), check the "
+                         "positions and their results" % minK)
+    return best
+
+
+def tune(codes, results, epochs=300, learningRate=2.0, workers=None, log=print):
+    # Adam on the full batch, returns the tuned parameters
+    workers = workers or os.cpu_count() or 1
+    params = currentParams()
+    # the king's material value is in every position for both sides so it cancels out, it is left alone
+    frozen = np.zeros(numParams, dtype=bool)
+    frozen[tableSize + pieceTypes.index('K')] = True
+    k = fitK(Chunk(codes[:100000], results[:100000]), params)
+    log("K = %.3f" % k)
+    # one single process pool per slice of the positions, so each slice stays in the same worker for every step
+    splits = np.array_split(np.arange(len(results)), workers)
+    pools = [multiprocessing.Pool(1, initWorker, (codes[split], results[split])) for split in splits]
+    m = np.zeros(numParams)
+    v = np.zeros(numParams)
+    beta1, beta2 = 0.9, 0.999
+    try:
+        for epoch in range(1, epochs + 1):
+            replies = [p.apply_async(workerStep, ((params, k),)) for p in pools]
+            loss = 0
+            gradient = np.zeros(numParams)
+            for reply in replies:
+                chunkLoss, chunkGradient = reply.get()
+                loss += chunkLoss
+                gradient += chunkGradient
+            loss /= len(results)
+            gradient /= len(results)
+            gradient[frozen] = 0
+            m = beta1 * m + (1 - beta1) * gradient
+            v = beta2 * v + (1 - beta2) * gradient ** 2
+            params -= learningRate * (m / (1 - beta1 ** epoch)) / (np.sqrt(v / (1 - beta2 ** epoch)) + 1e-12)
+            if epoch == 1 or epoch % 10 == 0:
+                log("epoch %d loss %.6f" % (epoch, loss))
+    finally:
+        for p in pools:
+            p.terminate()
+    return params
+
+
+def paramsToTables(params):
+    rounded = np.rint(params).astype(int)
+    material = {pieceType: int(rounded[tableSize + t]) for t, pieceType in enumerate(pieceTypes)}
+    pieceSquare = {pieceType: rounded[t * 64:(t + 1) * 64].reshape(8, 8).tolist()
+                   for t, pieceType in enumerate(pieceTypes)}
+    return {'material': material, 'pieceSquare': pieceSquare}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune the evaluation tables on a set of labelled positions")
+    parser.add_argument('dataset')
+    parser.add_argument('--epochs', type=int, default=300)
+    parser.add_argument('--learning-rate', type=float, default=2.0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=ChessEngine.evalTablesPath)
+    args = parser.parse_args()
+    codes, results = loadDataset(args.dataset)
+    print("Loaded", len(results), "positions")
+    params = tune(codes, results, args.epochs, args.learning_rate, args.workers)
+    with open(args.output, 'w') as f:
+        json.dump(paramsToTables(params), f, indent=1)
+    print("Written to", args.output)